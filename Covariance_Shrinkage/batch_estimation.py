@@ -0,0 +1,128 @@
+# Batched estimation of many covariance matrices in one call
+# A stack of equal-shape data matrices (B x n x p) is handled with stacked linear
+# algebra, optionally split over worker processes; a ragged list of data matrices
+# is dispatched to a process pool, one estimation per task.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import *
+from ledoit_and_wolf_2001 import LedoitAndWolf_2001
+from direct_kernel import DirectKernel
+
+
+def ledoit_wolf_stack(data_matrices, method='vectorized', chunk_size=100):
+    """
+    LedoitAndWolf_2001.compute_weighted_estimator for a B x n x p stack of data matrices,
+    built on the same helpers with a batch dimension. Returns arrays (res,
+    shrinkage_constant, shrinkage_parameter, p, r, c) with a leading batch dimension.
+    Only method='vectorized' is stacked, chunk_size is accepted for the same signature.
+    """
+    if method != 'vectorized':
+        raise ValueError('Method %s is not available for stacks, use vectorized' % method)
+    X = np.asarray(data_matrices, dtype=float)
+    num_observations = X.shape[1]
+    X = X - np.mean(X, axis=1, keepdims=True)
+    MLE_estimator = np.matmul(X.transpose(0, 2, 1), X) / num_observations
+    SIM_covariance = LedoitAndWolf_2001.single_index_covariance(MLE_estimator)
+    statistics = compute_fourth_moment_statistics(X)
+    p, p_trace = LedoitAndWolf_2001.p_from_statistics(MLE_estimator, num_observations, statistics)
+    shrinkage_constant, p, r, c = LedoitAndWolf_2001.shrinkage_constant_from_statistics(
+        MLE_estimator, SIM_covariance, num_observations, p, p_trace, statistics)
+    shrinkage_parameter = shrinkage_constant / num_observations
+    use_SIM = (0 < shrinkage_parameter) & (shrinkage_parameter < 1)
+    weight = np.where(use_SIM, shrinkage_parameter, 0.0)[:, None, None]
+    res = weight*SIM_covariance + (1 - weight)*MLE_estimator
+    return res, shrinkage_constant, shrinkage_parameter, p, r, c
+
+
+def direct_kernel_stack(data_matrices, method='eig', factored=False, block_size=512, bandwidth_exponent=0.35):
+    """
+    DirectKernel.estimate_cov_matrix for a B x n x p stack of data matrices, same
+    arguments. The eigendecompositions of all B matrices run in one stacked call of
+    DirectKernel.decompose ('gram' is the fastest), the kernel estimation and PAV are
+    done per matrix. Returns a B x p x p array, or a list of (eigenvectors, dhat, dhat0)
+    if factored.
+    """
+    X = np.asarray(data_matrices, dtype=float)
+    n, p = X.shape[1:]
+    eigenvalues, eigenvectors, _ = DirectKernel.decompose(X, method)
+
+    results = []
+    for b in range(X.shape[0]):
+        dk = DirectKernel(X[b])
+        dk.n, dk.p = n, p
+        dk.eigenvalues = eigenvalues[b]
+        dk.eigenvectors = eigenvectors[b]
+        dk.decomposition_method = method
+        dk.decomposed_X = dk.X
+        results.append(dk.shrink_decomposition(factored, block_size, bandwidth_exponent))
+    if factored:
+        return results
+    return np.array(results)
+
+
+def _estimate_stack(task):
+    estimator, data_matrices, kwargs = task
+    if estimator == 'ledoit_wolf':
+        return ledoit_wolf_stack(data_matrices, **kwargs)
+    return direct_kernel_stack(data_matrices, **kwargs)
+
+
+def _stackable(estimator, kwargs):
+    # methods without a stacked version run one estimation per matrix
+    return estimator != 'ledoit_wolf' or kwargs.get('method', 'vectorized') == 'vectorized'
+
+
+def _unstack(estimator, results):
+    """ Splits the result of estimate_stack into one result per data matrix """
+    if estimator == 'ledoit_wolf':
+        return list(zip(*results))
+    return list(results)
+
+
+def _estimate_one(task):
+    estimator, data_matrix, kwargs = task
+    if estimator == 'ledoit_wolf':
+        return LedoitAndWolf_2001(data_matrix).compute_weighted_estimator(**kwargs)
+    return DirectKernel(data_matrix).estimate_cov_matrix(**kwargs)
+
+
+def estimate_stack(data_matrices, estimator='ledoit_wolf', max_workers=1, **kwargs):
+    """
+    Estimate the covariance matrices of a B x n x p stack of data matrices.
+    With max_workers > 1 the stack is split into max_workers sub-stacks processed in
+    parallel, each with stacked linear algebra, and the results are joined again.
+    """
+    if estimator not in ('ledoit_wolf', 'direct_kernel'):
+        raise ValueError('Unknown estimator %s, use ledoit_wolf or direct_kernel' % estimator)
+    data_matrices = np.asarray(data_matrices)
+    if max_workers is None or max_workers > 1:
+        num_chunks = min(max_workers or os.cpu_count(), data_matrices.shape[0])
+        with ProcessPoolExecutor(max_workers) as executor:
+            tasks = [(estimator, chunk, kwargs) for chunk in np.array_split(data_matrices, num_chunks)]
+            chunks = list(executor.map(_estimate_stack, tasks))
+        if estimator == 'ledoit_wolf':
+            return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+        if kwargs.get('factored', False):
+            return [result for chunk in chunks for result in chunk]
+        return np.concatenate(chunks)
+    return _estimate_stack((estimator, data_matrices, kwargs))
+
+
+def estimate_many(data_matrices, estimator='ledoit_wolf', max_workers=None, **kwargs):
+    """
+    Estimate the covariance matrices of a list of data matrices.
+    Returns a list with what the single estimator returns for every data matrix
+    (compute_weighted_estimator or estimate_cov_matrix called with kwargs). Equal shapes
+    are stacked and passed to estimate_stack, ragged lists (and ledoit_wolf methods
+    other than vectorized) are dispatched to a process pool of max_workers processes
+    (default: number of cores), one estimation per task.
+    """
+    if estimator not in ('ledoit_wolf', 'direct_kernel'):
+        raise ValueError('Unknown estimator %s, use ledoit_wolf or direct_kernel' % estimator)
+    if len(set(np.shape(data_matrix) for data_matrix in data_matrices)) == 1 and _stackable(estimator, kwargs):
+        return _unstack(estimator, estimate_stack(np.stack(data_matrices), estimator, max_workers, **kwargs))
+    tasks = [(estimator, data_matrix, kwargs) for data_matrix in data_matrices]
+    with ProcessPoolExecutor(max_workers) as executor:
+        return list(executor.map(_estimate_one, tasks))
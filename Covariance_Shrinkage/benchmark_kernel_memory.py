@@ -0,0 +1,39 @@
+# Peak memory and run time of the kernel estimates ftilda and Hftilda in DirectKernel,
+# full-matrix evaluation (block_size=None) against row tiles of block_size eigenvalues.
+# Peak memory is measured with tracemalloc, which tracks numpy allocations.
+
+import time
+import tracemalloc
+
+import numpy as np
+from direct_kernel import DirectKernel
+
+
+def measure(eigenvalues, h, block_size):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    ftilda, Hftilda = DirectKernel.kernel_estimates(eigenvalues, h, block_size)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (ftilda, Hftilda), peak, elapsed
+
+
+def run_benchmark(sizes=(500, 1000, 2000), block_sizes=(None, 512, 128), seed=0):
+    rng = np.random.RandomState(seed)
+    print('%8s %12s %16s %12s' % ('size', 'block_size', 'peak [MB]', 'time [s]'))
+    for size in sizes:
+        eigenvalues = np.sort(rng.chisquare(5, size))
+        h = size ** (-0.35)
+        reference = None
+        for block_size in block_sizes:
+            result, peak, elapsed = measure(eigenvalues, h, block_size)
+            if reference is None:
+                reference = result
+            else:
+                assert np.allclose(result[0], reference[0]) and np.allclose(result[1], reference[1])
+            print('%8d %12s %16.1f %12.4f' % (size, block_size, peak / 2.0**20, elapsed))
+
+
+if __name__ == '__main__':
+    run_benchmark()
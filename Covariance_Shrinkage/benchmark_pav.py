@@ -0,0 +1,33 @@
+# Benchmark of the stack-based isotonic regression (DirectKernel.pav / utils.isotonic_regression)
+# against the rescanning implementation (DirectKernel.pav_rescan)
+# on random inputs and on adversarial, strictly decreasing inputs.
+
+import timeit
+
+import numpy as np
+from direct_kernel import DirectKernel
+
+
+def time_function(function, y, repeat):
+    return min(timeit.repeat(lambda: function(y), number=1, repeat=repeat))
+
+
+def run_benchmark(sizes=(100, 1000, 5000), repeat=3, seed=0):
+    dk = DirectKernel(None)
+    rng = np.random.RandomState(seed)
+    inputs = {
+        'random': lambda size: rng.randn(size),
+        'decreasing': lambda size: np.arange(size, 0, -1, dtype=float),
+    }
+    print('%-12s %8s %14s %14s %10s' % ('input', 'size', 'rescan [s]', 'stack [s]', 'speedup'))
+    for name, generate in inputs.items():
+        for size in sizes:
+            y = generate(size)
+            assert np.allclose(dk.pav(y), dk.pav_rescan(y))
+            t_rescan = time_function(dk.pav_rescan, y, repeat)
+            t_stack = time_function(dk.pav, y, repeat)
+            print('%-12s %8d %14.6f %14.6f %10.1f' % (name, size, t_rescan, t_stack, t_rescan / t_stack))
+
+
+if __name__ == '__main__':
+    run_benchmark()
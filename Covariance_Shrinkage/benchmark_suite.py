@@ -0,0 +1,105 @@
+# Benchmark suite for the covariance estimators
+# Times and memory-profiles DirectKernel.estimate_cov_matrix,
+# LedoitAndWolf_2001.compute_weighted_estimator and the utils helpers over a grid
+# of n (observations) and p/n ratios, and writes the results as JSON so runs of
+# different versions can be compared.
+#
+# usage: python benchmark_suite.py --n 100 250 500 --ratio 0.25 0.5 1 2 --output results.json
+
+import argparse
+import datetime as dt
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from utils import *
+from ledoit_and_wolf_2001 import LedoitAndWolf_2001
+from direct_kernel import DirectKernel
+
+
+def benchmark_cases():
+    """ name -> function of the data matrix to benchmark """
+    return {
+        'direct_kernel.eig': lambda X: DirectKernel(X).estimate_cov_matrix(method='eig'),
+        'direct_kernel.gram': lambda X: DirectKernel(X).estimate_cov_matrix(method='gram'),
+        'ledoit_wolf.vectorized': lambda X: LedoitAndWolf_2001(X).compute_weighted_estimator(method='vectorized'),
+        'utils.centering_data_matrix': centering_data_matrix,
+        'utils.sample_caovariance_matrix': sample_caovariance_matrix,
+        'utils.take_a_sample': lambda X: take_a_sample(X, 0.5),
+        'utils.isotonic_regression': lambda X: isotonic_regression(X[0]),
+    }
+
+
+def generate_data(n, p, seed):
+    """ Returns with a few common factors, centered """
+    rng = np.random.RandomState(seed)
+    factors = rng.randn(n, 3)
+    loadings = rng.randn(3, p)
+    X = 0.01 * (factors.dot(loadings) + rng.randn(n, p))
+    return centering_data_matrix(X)
+
+
+def measure(function, X, repeat):
+    """ Best wall time over repeat runs, then peak traced memory of one more run;
+    memory is measured separately since tracemalloc slows down allocations """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function(X)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    function(X)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(ns, ratios, cases=None, repeat=3, seed=0):
+    all_cases = benchmark_cases()
+    cases = list(all_cases) if cases is None else cases
+    results = []
+    for n in ns:
+        for ratio in ratios:
+            p = max(1, int(round(n * ratio)))
+            X = generate_data(n, p, seed)
+            for case in cases:
+                seconds, peak = measure(all_cases[case], X, repeat)
+                results.append({'case': case, 'n': n, 'p': p, 'ratio': p / n,
+                                'seconds': seconds, 'peak_memory_bytes': peak})
+                print('%-32s n=%6d p=%6d %10.4f s %10.1f MB' % (case, n, p, seconds, peak / 2.0**20))
+    return {
+        'metadata': {
+            'timestamp': dt.datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Covariance estimator benchmark suite')
+    parser.add_argument('--n', type=int, nargs='+', default=[100, 250, 500])
+    parser.add_argument('--ratio', type=float, nargs='+', default=[0.25, 0.5, 1.0, 2.0])
+    parser.add_argument('--case', nargs='+', default=None, choices=sorted(benchmark_cases()))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+    report = run_suite(args.n, args.ratio, args.case, args.repeat, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to %s' % args.output)
@@ -0,0 +1,88 @@
+# Parallel bootstrap of the shrinkage estimators
+# Resamples are drawn with utils.take_a_sample and estimated across a process pool.
+# The data matrix is placed once in shared memory and attached by every worker
+# instead of being pickled to each task. Every chunk of resamples gets its own
+# random stream spawned from one np.random.SeedSequence, so the results only
+# depend on the seed and chunk_size, not on the number of workers.
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from utils import *
+from ledoit_and_wolf_2001 import LedoitAndWolf_2001
+from direct_kernel import DirectKernel
+
+_worker_state = {}
+
+
+def _attach_data_matrix(name, shape, dtype):
+    _worker_state['shared_memory'] = shared_memory.SharedMemory(name=name)
+    _worker_state['data_matrix'] = np.ndarray(shape, dtype=dtype, buffer=_worker_state['shared_memory'].buf)
+
+
+def _run_chunk(task):
+    estimator, num_resamples, seed_sequence, sample_size, replace, keep_estimates, kwargs = task
+    data_matrix = _worker_state['data_matrix']
+    random_state = np.random.default_rng(seed_sequence)
+    p = data_matrix.shape[1]
+    estimates = np.empty((num_resamples, p, p)) if keep_estimates else None
+    if estimator == 'ledoit_wolf':
+        statistics = np.empty((num_resamples, 2))
+    else:
+        statistics = np.empty((num_resamples, p))
+    for k in range(num_resamples):
+        sample = take_a_sample(data_matrix, sample_size, replace, random_state)
+        if estimator == 'ledoit_wolf':
+            res, shrinkage_constant, shrinkage_parameter, _, _, _ = \
+                LedoitAndWolf_2001(sample).compute_weighted_estimator(**kwargs)
+            statistics[k] = shrinkage_constant, shrinkage_parameter
+        else:
+            eigenvectors, dhat, dhat0 = DirectKernel(sample).estimate_cov_matrix(factored=True, **kwargs)
+            statistics[k] = np.hstack((np.full(p - dhat.shape[0], dhat0), dhat))
+            res = DirectKernel.assemble(eigenvectors, statistics[k]) if keep_estimates else None
+        if keep_estimates:
+            estimates[k] = res
+    return statistics, estimates
+
+
+def bootstrap(data_matrix, estimator='ledoit_wolf', num_resamples=100, sample_size=1.0, replace=True,
+              seed=None, max_workers=None, chunk_size=10, keep_estimates=True, **estimator_kwargs):
+    """
+    Run num_resamples resamples of LedoitAndWolf_2001 ('ledoit_wolf') or DirectKernel
+    ('direct_kernel') on a process pool of max_workers processes.
+
+    sample_size, replace: passed to utils.take_a_sample, the default is the classical
+    bootstrap with replacement
+    estimator_kwargs: passed to compute_weighted_estimator / estimate_cov_matrix
+
+    Returns a dict of arrays with a leading resample dimension:
+        'shrinkage_constants', 'shrinkage_parameters' (ledoit_wolf) or
+        'eigenvalues', the shrunk spectrum in ascending order (direct_kernel), and
+        'estimates' (num_resamples x p x p) if keep_estimates
+    """
+    if estimator not in ('ledoit_wolf', 'direct_kernel'):
+        raise ValueError('Unknown estimator %s, use ledoit_wolf or direct_kernel' % estimator)
+    data_matrix = np.ascontiguousarray(data_matrix, dtype=float)
+    chunks = [min(chunk_size, num_resamples - start) for start in range(0, num_resamples, chunk_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(estimator, chunk, seed_sequence, sample_size, replace, keep_estimates, estimator_kwargs)
+             for chunk, seed_sequence in zip(chunks, seed_sequences)]
+
+    shared = shared_memory.SharedMemory(create=True, size=data_matrix.nbytes)
+    try:
+        np.ndarray(data_matrix.shape, dtype=data_matrix.dtype, buffer=shared.buf)[:] = data_matrix
+        with ProcessPoolExecutor(max_workers, initializer=_attach_data_matrix,
+                                 initargs=(shared.name, data_matrix.shape, data_matrix.dtype)) as executor:
+            results = list(executor.map(_run_chunk, tasks))
+    finally:
+        shared.close()
+        shared.unlink()
+
+    statistics = np.concatenate([result[0] for result in results])
+    if estimator == 'ledoit_wolf':
+        output = {'shrinkage_constants': statistics[:, 0], 'shrinkage_parameters': statistics[:, 1]}
+    else:
+        output = {'eigenvalues': statistics}
+    if keep_estimates:
+        output['estimates'] = np.concatenate([result[1] for result in results])
+    return output
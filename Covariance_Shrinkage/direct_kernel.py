@@ -3,6 +3,7 @@
 Ledoit and Wolf, Oct 2017,
 translated from anthers Matlab code'''
 import numpy as np
+from utils import isotonic_regression
 
 
 class DirectKernel(object):
@@ -14,14 +15,27 @@ class DirectKernel(object):
         self.sample = None
         self.eigenvalues = None
         self.eigenvectors = None
-        self.L = None
+        self.decomposition_method = None
+        self.decomposed_X = None
         self.h = None
+        self.sweep_h = None
+        self.sweep_spectra = None
 
     def pav(self, y):
+        """
+        PAV uses the pair adjacent violators method to produce a monotonic
+        smoothing of y, see utils.isotonic_regression
+        """
+        # np.linalg.eig may leave round-off imaginary parts in the eigenvalues
+        return isotonic_regression(np.real(y))
+
+    def pav_rescan(self, y):
         """
         PAV uses the pair adjacent violators method to produce a monotonic
         smoothing of y
         translated from matlab by Sean Collins (2006) as part of the EMAP toolbox
+        Rescans the whole vector after every merge, quadratic in the worst case;
+        kept as a reference for pav.
         """
         y = np.asarray(y)
         assert y.ndim == 1
@@ -50,50 +64,222 @@ class DirectKernel(object):
                 lvlsets[i, 1] = last
         return v
 
-    def estimate_cov_matrix(self):
+    def decompose_sample(self, method='eig'):
+        """
+        Extract the sample eigenvalues sorted in ascending order and the eigenvectors.
 
-        # extract sample eigenvalues sorted in ascending order and eigenvectors
+        method: 'eig'  - general eigendecomposition of the p x p sample matrix
+                'gram' - symmetric eigendecomposition of the smaller of X'X/n and XX'/n
+                'svd'  - thin SVD of X
+        With 'gram' and 'svd' only the min(n, p) eigenvectors spanning the range of
+        the sample matrix are computed, the p - n null eigenvectors are never formed.
+        The decomposition is cached on the instance and reused by later calls with the
+        same method as long as self.X is the same array; call reset after changing X
+        in place.
+        """
+        if self.decomposition_method == method and self.decomposed_X is self.X \
+                and self.eigenvalues is not None:
+            return self.eigenvalues, self.eigenvectors
         self.n, self.p = self.X.shape
-        self.sample = (self.X.transpose() @ self.X) / self.n
-        self.eigenvalues, self.eigenvectors = np.linalg.eig(self.sample)
-        isort = np.argsort(self.eigenvalues, axis=-1)
-        self.eigenvalues.sort()
-        self.eigenvectors = self.eigenvectors[:, isort]
+        self.eigenvalues, self.eigenvectors, self.sample = self.decompose(self.X, method)
+        self.decomposition_method = method
+        self.decomposed_X = self.X
+        return self.eigenvalues, self.eigenvectors
 
-        # compute direct kernel estimator
+    def reset(self):
+        """ Drop the cached decomposition, e.g. after X was modified in place """
+        self.decomposition_method = None
+        self.decomposed_X = None
+
+    @staticmethod
+    def decompose(X, method='eig'):
+        """
+        Sample eigenvalues (ascending), eigenvectors and sample matrix (None if not
+        formed) of the data matrix X, see decompose_sample. Leading dimensions of X
+        (a stack of data matrices) are batch dimensions of the stacked solvers.
+        """
+        n, p = X.shape[-2:]
+        X_transposed = np.swapaxes(X, -1, -2)
+        sample = None
+        if method == 'eig':
+            sample = (X_transposed @ X) / n
+            eigenvalues, eigenvectors = np.linalg.eig(sample)
+            isort = np.argsort(eigenvalues, axis=-1)
+            eigenvalues = np.take_along_axis(eigenvalues, isort, axis=-1)
+            eigenvectors = np.take_along_axis(eigenvectors, isort[..., None, :], axis=-1)
+            eigenvalues = eigenvalues[..., max(1, p - n + 1) - 1:p]
+        elif method == 'gram':
+            if p <= n:
+                sample = (X_transposed @ X) / n
+                eigenvalues, eigenvectors = np.linalg.eigh(sample)
+            else:
+                gram = (X @ X_transposed) / n
+                eigenvalues, gram_eigenvectors = np.linalg.eigh(gram)
+                eigenvectors = X_transposed @ gram_eigenvectors
+                eigenvectors /= np.linalg.norm(eigenvectors, axis=-2, keepdims=True)
+        elif method == 'svd':
+            _, singular_values, vt = np.linalg.svd(X, full_matrices=False)
+            eigenvalues = singular_values[..., ::-1] ** 2 / n
+            eigenvectors = np.swapaxes(vt[..., ::-1, :], -1, -2)
+        else:
+            raise ValueError('Unknown method %s, use eig, gram or svd' % method)
+        return eigenvalues, eigenvectors, sample
+
+    def estimate_cov_matrix(self, method='eig', factored=False, block_size=512, bandwidth_exponent=0.35):
+        """
+        method: see decompose_sample
+        factored: if True, return (eigenvectors, dhat, dhat0) instead of the dense
+        p x p matrix, where eigenvectors holds the min(n, p) range eigenvectors and
+        sigmahat = eigenvectors diag(dhat) eigenvectors' + dhat0 (I - eigenvectors eigenvectors')
+        block_size: see kernel_estimates
+        bandwidth_exponent: the kernel bandwidth is h = n^-bandwidth_exponent
+        """
+        self.decompose_sample(method)
+        return self.shrink_decomposition(factored, block_size, bandwidth_exponent)
+
+    def sweep_bandwidths(self, exponents, method='eig', block_size=512):
+        """
+        Shrunk spectra dhat (ascending, one row of length p per exponent) for the
+        bandwidths h = n^-exponent. The sample is decomposed once (cached) and the kernel
+        estimates for all bandwidths are evaluated in one vectorized pass, holding
+        len(exponents) x block_size x min(n, p) values per tile. Matrices are only built
+        on request with sweep_matrix.
+        """
+        self.decompose_sample(method)
+        self.sweep_h = self.n ** -np.asarray(exponents, dtype=float)
+        ftilda, Hftilda = self.kernel_estimates(self.eigenvalues, self.sweep_h, block_size)
+        dtilde = self.compute_dtilde(ftilda, Hftilda, self.sweep_h)
+        self.sweep_spectra = np.array([self.pav(row) for row in dtilde])
+        return self.sweep_spectra
+
+    def sweep_matrix(self, index, factored=False):
+        """ sigmahat for the index-th bandwidth of the last sweep_bandwidths call """
+        return self.assemble(self.eigenvectors, self.sweep_spectra[index], factored)
+
+    def decompose_given_sample(self, sample, n):
+        """
+        Same as decompose_sample for an already computed p x p sample matrix of n
+        observations, using the symmetric solver.
+        """
+        self.p = sample.shape[0]
+        self.n = n
+        self.sample = sample
+        self.eigenvalues, self.eigenvectors = np.linalg.eigh(self.sample)
         self.eigenvalues = self.eigenvalues[max(1, self.p - self.n + 1) - 1:self.p]
-        self.L = np.repeat(self.eigenvalues, min(self.n, self.p), axis=0).reshape(self.eigenvalues.shape[0], min(self.n, self.p))
-        self.h = self.n ** (-0.35)
-        component_00 = 4*(self.L.T**2)*self.h**2 - (self.L - self.L.T)**2
-        component_0 = np.maximum(np.zeros((component_00.shape[1], component_00.shape[1])), component_00)
-        component_a = np.sqrt(component_0)
-        component_b = 2*np.pi*(self.L.T**2)*self.h**2
-        ftilda = np.mean(component_a / component_b, axis=1)
+        self.decomposition_method = 'given'
+        return self.eigenvalues, self.eigenvectors
 
-        com_1 = np.sign(self.L - self.L.T)
-        com_2_1 = (self.L - self.L.T)**2 - 4*self.L.T**2*self.h**2
-        com_2 = np.maximum(np.zeros((com_2_1.shape[1], com_2_1.shape[1])), com_2_1)
-        com_3_1 = np.sqrt(com_2)
-        com_3_2 = com_1 * com_3_1
-        com_3 = com_3_2 - self.L + self.L.T
-        com_4 = 2*np.pi*self.L.T**2*self.h**2
-        com_5 = com_3 / com_4
-        Hftilda = np.mean(com_5, axis=1)
+    def shrink_decomposition(self, factored=False, block_size=512, bandwidth_exponent=0.35):
+        """ Direct kernel estimator from the sample eigenvalues and eigenvectors set by
+        decompose_sample or decompose_given_sample, see estimate_cov_matrix """
+        # compute direct kernel estimator
+        self.h = self.n ** (-bandwidth_exponent)
+        ftilda, Hftilda = self.kernel_estimates(self.eigenvalues, self.h, block_size)
+        dtilde = self.compute_dtilde(ftilda, Hftilda, self.h)
+        dhat = self.pav(dtilde)
+        return self.assemble(self.eigenvectors, dhat, factored)
 
+    def compute_dtilde(self, ftilda, Hftilda, h):
+        """ Shrunk eigenvalues before PAV; ftilda and Hftilda have shape (..., min(n, p))
+        with leading dimensions matching those of h """
+        h = np.asarray(h)[..., None]
         if self.p <= self.n:
             com_0 = (np.pi*(self.p/self.n)*self.eigenvalues*ftilda)**2
             com_1 = (1 - (self.p / self.n) - np.pi * (self.p / self.n) * self.eigenvalues * Hftilda) ** 2
             com_2 = com_0 + com_1
             dtilde = self.eigenvalues / com_2
         else:
-            Hftilda0 = (1-np.sqrt(max(1-4*self.h**2, 0))) / (2*np.pi*self.n*self.h**2)*np.mean(1/self.eigenvalues)
+            Hftilda0 = (1-np.sqrt(np.maximum(1-4*h**2, 0))) / (2*np.pi*self.n*h**2)*np.mean(1/self.eigenvalues)
             dtilde0 = 1/(np.pi*((self.p-self.n)/self.n)*Hftilda0)
             dtilde1 = self.eigenvalues/np.pi**2*self.eigenvalues**2*(ftilda**2+Hftilda**2)
-            dtilde = np.hstack((dtilde0*np.ones((self.p-self.n, 1)).reshape(self.p-self.n,), dtilde1))
+            dtilde = np.concatenate((np.broadcast_to(dtilde0, dtilde1.shape[:-1] + (self.p - self.n,)), dtilde1), axis=-1)
+        return dtilde
 
-        dhat = self.pav(dtilde)
-        d_matrix = np.diag(dhat)
-        sigmahat = self.eigenvectors.dot(d_matrix).dot(self.eigenvectors.T)
+    @staticmethod
+    def kernel_estimates(eigenvalues, h, block_size=512):
+        """
+        Kernel estimates ftilda and Hftilda of the density of the sample eigenvalues
+        and of its Hilbert transform.
+
+        The min(n, p) x min(n, p) kernel matrix is evaluated in tiles of block_size rows
+        and only row means are kept, so at most a few block_size x min(n, p) arrays are
+        alive at once. block_size=None evaluates the full matrices in one go.
+
+        h may also be an array of bandwidths, ftilda and Hftilda then get a leading
+        bandwidth dimension and the tiles hold len(h) x block_size x min(n, p) values.
+        """
+        h = np.asarray(h)
+        m = eigenvalues.shape[0]
+        if block_size is None:
+            if h.ndim == 0:
+                return DirectKernel.kernel_estimates_dense(eigenvalues, h)
+            block_size = m
+        h = h[..., None, None]
+        four_l2h2 = 4*eigenvalues**2*h**2
+        denominator = 2*np.pi*eigenvalues**2*h**2
+        dtype = np.result_type(eigenvalues, h)
+        ftilda = np.empty(h.shape[:-2] + (m,), dtype=dtype)
+        Hftilda = np.empty(h.shape[:-2] + (m,), dtype=dtype)
+        for start in range(0, m, block_size):
+            stop = min(start + block_size, m)
+            # differences lambda_i - lambda_j for the rows i of the tile
+            diff = eigenvalues[start:stop, None] - eigenvalues
+            squared = np.square(diff)
+            component = np.subtract(four_l2h2, squared)
+            np.maximum(component, 0, out=component)
+            np.sqrt(component, out=component)
+            component /= denominator
+            ftilda[..., start:stop] = component.mean(axis=-1)
+
+            np.subtract(squared, four_l2h2, out=component)
+            np.maximum(component, 0, out=component)
+            np.sqrt(component, out=component)
+            component *= np.sign(diff)
+            component -= diff
+            component /= denominator
+            Hftilda[..., start:stop] = component.mean(axis=-1)
+        return ftilda, Hftilda
+
+    @staticmethod
+    def kernel_estimates_dense(eigenvalues, h):
+        """ Full-matrix evaluation of kernel_estimates, kept as a reference """
+        L = np.repeat(eigenvalues, eigenvalues.shape[0], axis=0).reshape(eigenvalues.shape[0], eigenvalues.shape[0])
+        component_00 = 4*(L.T**2)*h**2 - (L - L.T)**2
+        component_0 = np.maximum(np.zeros((component_00.shape[1], component_00.shape[1])), component_00)
+        component_a = np.sqrt(component_0)
+        component_b = 2*np.pi*(L.T**2)*h**2
+        ftilda = np.mean(component_a / component_b, axis=1)
+
+        com_1 = np.sign(L - L.T)
+        com_2_1 = (L - L.T)**2 - 4*L.T**2*h**2
+        com_2 = np.maximum(np.zeros((com_2_1.shape[1], com_2_1.shape[1])), com_2_1)
+        com_3_1 = np.sqrt(com_2)
+        com_3_2 = com_1 * com_3_1
+        com_3 = com_3_2 - L + L.T
+        com_4 = 2*np.pi*L.T**2*h**2
+        com_5 = com_3 / com_4
+        Hftilda = np.mean(com_5, axis=1)
+        return ftilda, Hftilda
+
+    @staticmethod
+    def assemble(eigenvectors, dhat, factored=False):
+        """
+        Rebuild sigmahat from the shrunk eigenvalues dhat (length p, ascending).
+        eigenvectors is either the full p x p basis or only the last min(n, p)
+        range eigenvectors; the leading p - min(n, p) entries of dhat are equal
+        and act as a constant on the null space.
+        """
+        p = dhat.shape[0]
+        rank = min(eigenvectors.shape[1], p)
+        range_eigenvectors = eigenvectors[:, eigenvectors.shape[1] - rank:]
+        dhat_range = dhat[p - rank:]
+        dhat0 = dhat[0] if rank < p else 0.0
+        if factored:
+            return range_eigenvectors, dhat_range, dhat0
+        if eigenvectors.shape[1] == p:
+            return (eigenvectors * dhat).dot(eigenvectors.T)
+        sigmahat = (range_eigenvectors * (dhat_range - dhat0)).dot(range_eigenvectors.T)
+        sigmahat[np.diag_indices(p)] += dhat0
         return sigmahat
 
 
@@ -15,6 +15,36 @@ class LedoitAndWolf_2001(object):
 
         self.MLE_estimator = sample_caovariance_matrix(self.data_matrix_centered)
         self.SIM_covariance = self.create_single_index_covariance_matrix()
+        self.fourth_moment_statistics = None
+
+    @classmethod
+    def from_centered_data(cls, data_matrix_centered, MLE_estimator):
+        """ Build the estimator from already centered data and its sample covariance
+        matrix, e.g. maintained incrementally, without recomputing them """
+        estimator = cls.__new__(cls)
+        estimator.data_matrix = data_matrix_centered
+        estimator.num_variables = data_matrix_centered.shape[1]
+        estimator.num_observations = data_matrix_centered.shape[0]
+        estimator.data_matrix_centered = data_matrix_centered
+        estimator.MLE_estimator = MLE_estimator
+        estimator.SIM_covariance = estimator.create_single_index_covariance_matrix()
+        estimator.fourth_moment_statistics = None
+        return estimator
+
+    @classmethod
+    def from_moments(cls, MLE_estimator, num_observations, fourth_moment_statistics):
+        """ Build the estimator without the data matrix, from the sample covariance matrix
+        and the output of utils.compute_fourth_moment_statistics (e.g. accumulated over
+        blocks of a file). Only the vectorized method is available. """
+        estimator = cls.__new__(cls)
+        estimator.data_matrix = None
+        estimator.num_variables = MLE_estimator.shape[0]
+        estimator.num_observations = num_observations
+        estimator.data_matrix_centered = None
+        estimator.MLE_estimator = MLE_estimator
+        estimator.SIM_covariance = estimator.create_single_index_covariance_matrix_from_MLE()
+        estimator.fourth_moment_statistics = fourth_moment_statistics
+        return estimator
 
     def compute_betas_and_x0t(self):
         betas = []
@@ -32,6 +62,21 @@ class LedoitAndWolf_2001(object):
             F[i,i] = self.MLE_estimator[i, i]
         return F
 
+    def create_single_index_covariance_matrix_from_MLE(self):
+        """ Same as create_single_index_covariance_matrix: for centered data the
+        covariances with x0t are the row sums of the sample covariance matrix """
+        return np.matrix(self.single_index_covariance(self.MLE_estimator))
+
+    @staticmethod
+    def single_index_covariance(MLE_estimator):
+        """ create_single_index_covariance_matrix_from_MLE as array; leading dimensions
+        of MLE_estimator (a stack of sample covariance matrices) are kept """
+        betas = np.sum(MLE_estimator, axis=-1)
+        F = betas[..., :, None]*betas[..., None, :] / np.sum(MLE_estimator, axis=(-2, -1))[..., None, None]
+        diagonal = np.arange(F.shape[-1])
+        F[..., diagonal, diagonal] = np.diagonal(MLE_estimator, axis1=-2, axis2=-1)
+        return F
+
     def compute_optimal_shrinkage_constant_for_SIM(self):
 
         # c
@@ -74,9 +119,76 @@ class LedoitAndWolf_2001(object):
 
         return shrinkage_param, p, r, c
 
+    def compute_optimal_shrinkage_constant_for_SIM_vectorized(self):
+        """ Array-based version of compute_optimal_shrinkage_constant_for_SIM,
+        only the sum and the trace of p_temp are needed and both are obtained
+        from O(n p) sums of the centered data, see utils.compute_fourth_moment_statistics """
+        statistics = self.fourth_moment_statistics
+        if statistics is None:
+            statistics = compute_fourth_moment_statistics(self.data_matrix_centered)
+        p, p_trace = self.p_from_statistics(self.MLE_estimator, self.num_observations, statistics)
+        return self._shrinkage_constant(p, p_trace, statistics)
+
+    @staticmethod
+    def p_from_statistics(MLE_estimator, num_observations, statistics):
+        """ Sum and trace of p_temp from utils.compute_fourth_moment_statistics; leading
+        dimensions are batch dimensions """
+        p = statistics['row_sums_squared'] / num_observations - np.sum(MLE_estimator ** 2, axis=(-2, -1))
+        p_trace = np.sum(statistics['fourth_powers'], axis=-1) / num_observations \
+            - np.sum(np.diagonal(MLE_estimator, axis1=-2, axis2=-1) ** 2, axis=-1)
+        return p, p_trace
+
+    def compute_optimal_shrinkage_constant_for_SIM_chunked(self, chunk_size=100):
+        """ Same as compute_optimal_shrinkage_constant_for_SIM_vectorized but p_temp is
+        accumulated over blocks of chunk_size observations, so at most
+        chunk_size x num_variables x num_variables values are alive at once """
+        X = self.data_matrix_centered
+        p_temp = np.zeros((self.num_variables, self.num_variables))
+        for start in range(0, self.num_observations, chunk_size):
+            block = X[start:start + chunk_size]
+            deviations = block[:, :, None] * block[:, None, :]
+            deviations -= self.MLE_estimator
+            np.square(deviations, out=deviations)
+            p_temp += deviations.sum(axis=0)
+        p_temp /= self.num_observations
+        statistics = compute_fourth_moment_statistics(X)
+        return self._shrinkage_constant(np.sum(p_temp), np.trace(p_temp), statistics)
+
+    def _shrinkage_constant(self, p, p_trace, statistics):
+        return self.shrinkage_constant_from_statistics(self.MLE_estimator, self.SIM_covariance,
+                                                       self.num_observations, p, p_trace, statistics)
+
+    @staticmethod
+    def shrinkage_constant_from_statistics(MLE_estimator, SIM_covariance, num_observations, p, p_trace,
+                                           statistics):
+        """ Shrinkage constant, p, r and c from the sum and trace of p_temp and
+        utils.compute_fourth_moment_statistics; leading dimensions are batch dimensions """
+        # c
+        c = compute_frobenius_norm(MLE_estimator, SIM_covariance)
+
+        # r, only the diagonal differs from p_temp
+        s_i_0 = np.sum(MLE_estimator, axis=-1)
+        s_00 = np.sum(MLE_estimator, axis=(-2, -1))[..., None]
+        r_diagonal = (2*s_i_0*s_00*statistics['column_sums'] - s_i_0**2*statistics['weighted_squares']) / (s_00*s_00) \
+            - num_observations*np.diagonal(np.asarray(SIM_covariance), axis1=-2, axis2=-1) \
+            * np.diagonal(MLE_estimator, axis1=-2, axis2=-1)
+        r_diagonal = (1.0 / num_observations) * r_diagonal
+        r = p - p_trace + np.sum(r_diagonal, axis=-1)
+
+        shrinkage_param = (p - r) / c
+
+        return shrinkage_param, p, r, c
+
     ''' The main function run it in order to get the weighted estimator'''
-    def compute_weighted_estimator(self):
-        shirnkage_constant, p, r, c = self.compute_optimal_shrinkage_constant_for_SIM()
+    def compute_weighted_estimator(self, method='vectorized', chunk_size=100):
+        if method == 'loop':
+            shirnkage_constant, p, r, c = self.compute_optimal_shrinkage_constant_for_SIM()
+        elif method == 'vectorized':
+            shirnkage_constant, p, r, c = self.compute_optimal_shrinkage_constant_for_SIM_vectorized()
+        elif method == 'chunked':
+            shirnkage_constant, p, r, c = self.compute_optimal_shrinkage_constant_for_SIM_chunked(chunk_size)
+        else:
+            raise ValueError('Unknown method %s, use loop, vectorized or chunked' % method)
         shirnkage_parameter = shirnkage_constant/self.num_observations
         if 0 < shirnkage_parameter < 1:
             res = shirnkage_parameter*self.SIM_covariance + (1-shirnkage_parameter)*self.MLE_estimator
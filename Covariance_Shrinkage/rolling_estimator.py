@@ -0,0 +1,100 @@
+# Rolling-window covariance estimation
+# The sums and cross-products of the observations in the trailing window are
+# maintained with rank-one add/drop updates as the window slides, so updating
+# the sample covariance matrix costs O(p^2) per date instead of O(n p^2).
+
+from utils import *
+from ledoit_and_wolf_2001 import LedoitAndWolf_2001
+from direct_kernel import DirectKernel
+
+
+class RollingEstimator(object):
+
+    def __init__(self, window, estimator='ledoit_wolf', step=1, refresh=None, **estimator_kwargs):
+        """
+        window: number of observations in the trailing window
+        estimator: 'ledoit_wolf' (LedoitAndWolf_2001.compute_weighted_estimator) or
+                   'direct_kernel' (DirectKernel.shrink_decomposition)
+        step: emit an estimate every step-th date once the window is full
+        refresh: recompute the sums from the window every refresh dates to stop the
+                 rounding errors of the add/drop updates from accumulating, default window
+        estimator_kwargs: passed on to the estimator
+        """
+        if estimator not in ('ledoit_wolf', 'direct_kernel'):
+            raise ValueError('Unknown estimator %s, use ledoit_wolf or direct_kernel' % estimator)
+        self.window = window
+        self.estimator = estimator
+        self.step = step
+        self.refresh = window if refresh is None else refresh
+        self.estimator_kwargs = estimator_kwargs
+        self.num_seen = 0
+        self.buffer = None
+        self.shift = None
+        self.sums = None
+        self.cross_products = None
+
+    def update(self, observation):
+        """ Add one observation, drop the one leaving the window and return the shrunk
+        estimate on emission dates, None otherwise """
+        x = np.asarray(observation, dtype=float)
+        if self.buffer is None:
+            # sums are taken relative to a shift close to the mean for numerical stability
+            self.buffer = np.empty((self.window, x.shape[0]))
+            self.shift = x.copy()
+            self.sums = np.zeros(x.shape[0])
+            self.cross_products = np.zeros((x.shape[0], x.shape[0]))
+
+        position = self.num_seen % self.window
+        if self.num_seen >= self.window:
+            dropped = self.buffer[position] - self.shift
+            self.sums -= dropped
+            self.cross_products -= np.outer(dropped, dropped)
+        self.buffer[position] = x
+        added = x - self.shift
+        self.sums += added
+        self.cross_products += np.outer(added, added)
+        self.num_seen += 1
+
+        slides = self.num_seen - self.window
+        if slides < 0:
+            return None
+        if slides > 0 and slides % self.refresh == 0:
+            self.recompute_sums()
+        if slides % self.step != 0:
+            return None
+        return self.estimate()
+
+    def estimates(self, data_matrix):
+        """ Generator over (row index, estimate) for all emission dates of data_matrix """
+        for t in range(data_matrix.shape[0]):
+            estimate = self.update(data_matrix[t])
+            if estimate is not None:
+                yield t, estimate
+
+    def recompute_sums(self):
+        self.shift = np.mean(self.buffer, axis=0)
+        deviations = self.buffer - self.shift
+        self.sums = np.sum(deviations, axis=0)
+        self.cross_products = deviations.T.dot(deviations)
+
+    def mean(self):
+        return self.shift + self.sums / self.window
+
+    def sample_covariance(self):
+        """ Sample covariance matrix (1/n normalisation, as sample_caovariance_matrix) of the window """
+        mean_deviation = self.sums / self.window
+        return self.cross_products / self.window - np.outer(mean_deviation, mean_deviation)
+
+    def estimate(self):
+        data_matrix_centered = self.buffer - self.mean()
+        sample = self.sample_covariance()
+        if self.estimator == 'ledoit_wolf':
+            lw = LedoitAndWolf_2001.from_centered_data(data_matrix_centered, sample)
+            return lw.compute_weighted_estimator(**self.estimator_kwargs)
+        if sample.shape[0] <= self.window:
+            dk = DirectKernel(None)
+            dk.decompose_given_sample(sample, self.window)
+        else:
+            dk = DirectKernel(data_matrix_centered)
+            dk.decompose_sample('gram')
+        return dk.shrink_decomposition(**self.estimator_kwargs)
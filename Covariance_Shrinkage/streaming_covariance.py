@@ -0,0 +1,98 @@
+# Out-of-core sample covariance
+# The data matrix (n observations x p variables) is read from a .npy file or a raw
+# np.memmap in blocks of rows. Means and centered cross-products are computed per
+# block and merged with the pairwise update of Chan, Golub and LeVeque (1979),
+# which stays numerically stable for large n.
+
+from utils import *
+from ledoit_and_wolf_2001 import LedoitAndWolf_2001
+from direct_kernel import DirectKernel
+
+
+def load_data_matrix(path, dtype=None, shape=None):
+    """ Memory-map a data matrix, .npy files carry their own dtype and shape,
+    raw files need both """
+    if str(path).endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    if dtype is None or shape is None:
+        raise ValueError('dtype and shape are required for raw memmap files')
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+def iterate_blocks(data_matrix, block_size):
+    for start in range(0, data_matrix.shape[0], block_size):
+        yield np.asarray(data_matrix[start:start + block_size], dtype=float)
+
+
+class StreamingCovariance(object):
+
+    def __init__(self, num_variables=None):
+        self.num_observations = 0
+        self.mean = None
+        self.cross_products = None
+        if num_variables is not None:
+            self.mean = np.zeros(num_variables)
+            self.cross_products = np.zeros((num_variables, num_variables))
+
+    def update(self, block):
+        """ Add a block of observations (rows) """
+        block = np.asarray(block, dtype=float)
+        block_mean = np.mean(block, axis=0)
+        deviations = block - block_mean
+        self._merge(block.shape[0], block_mean, deviations.T.dot(deviations))
+        return self
+
+    def merge(self, other):
+        """ Combine with the accumulator of another set of observations """
+        if other.num_observations > 0:
+            self._merge(other.num_observations, other.mean, other.cross_products)
+        return self
+
+    def _merge(self, num_observations, mean, cross_products):
+        if self.num_observations == 0:
+            self.num_observations = num_observations
+            self.mean = mean.copy()
+            self.cross_products = cross_products.copy()
+            return
+        total = self.num_observations + num_observations
+        delta = mean - self.mean
+        self.cross_products += cross_products
+        self.cross_products += np.outer(delta, delta) * (self.num_observations * num_observations / total)
+        self.mean += delta * (num_observations / total)
+        self.num_observations = total
+
+    def fit(self, data_matrix, block_size=10000):
+        """ Single pass over a (memory-mapped) data matrix """
+        for block in iterate_blocks(data_matrix, block_size):
+            self.update(block)
+        return self
+
+    def sample_covariance(self):
+        """ MLE estimator (1/n normalisation, as sample_caovariance_matrix) """
+        return self.cross_products / self.num_observations
+
+    def fourth_moment_statistics(self, data_matrix, block_size=10000):
+        """ Second pass accumulating utils.compute_fourth_moment_statistics of the data
+        centered with the final mean, needed by LedoitAndWolf_2001 """
+        statistics = None
+        for block in iterate_blocks(data_matrix, block_size):
+            block_statistics = compute_fourth_moment_statistics(block - self.mean)
+            if statistics is None:
+                statistics = block_statistics
+            else:
+                for key in statistics:
+                    statistics[key] = statistics[key] + block_statistics[key]
+        return statistics
+
+    def ledoit_wolf(self, data_matrix, block_size=10000):
+        """ LedoitAndWolf_2001 built from the accumulated moments, use
+        compute_weighted_estimator() (vectorized method) on the result """
+        statistics = self.fourth_moment_statistics(data_matrix, block_size)
+        return LedoitAndWolf_2001.from_moments(self.sample_covariance(), self.num_observations, statistics)
+
+    def direct_kernel(self):
+        """ DirectKernel with the decomposed sample covariance matrix, use
+        shrink_decomposition() on the result """
+        dk = DirectKernel(None)
+        dk.decompose_given_sample(self.sample_covariance(), self.num_observations)
+        return dk
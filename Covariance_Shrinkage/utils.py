@@ -3,15 +3,17 @@ import numpy as np
 
 def centering_data_matrix(data_matrix):
     means_of_variables = np.mean(data_matrix, axis=0)
-    centered_data_matrix = \
-        data_matrix - means_of_variables*np.ones((data_matrix.shape[0], data_matrix.shape[1]))
+    centered_data_matrix = data_matrix - means_of_variables
     return centered_data_matrix
 
 
-def take_a_sample(data_matrix, sample_size):
+def take_a_sample(data_matrix, sample_size, replace=False, random_state=None):
+    # random_state: np.random.Generator or RandomState, defaults to the global numpy state
+    if random_state is None:
+        random_state = np.random
     sample = data_matrix[
-             np.random.choice(data_matrix.shape[0], int(data_matrix.shape[0]*sample_size),
-                              replace=False), :]
+             random_state.choice(data_matrix.shape[0], int(data_matrix.shape[0]*sample_size),
+                                 replace=replace), :]
     # print 'sample taken with dim of ', sample.shape[0], ' variables and ', sample.shape[1], 'observations'
     return sample
 
@@ -20,8 +22,29 @@ def sample_caovariance_matrix(data_matrix):
     return (1.0/data_matrix.shape[0])*data_matrix.T.dot(data_matrix)
 
 
+def compute_fourth_moment_statistics(data_matrix_centered):
+    """
+    Sums over the observations needed besides the sample covariance matrix for the
+    shrinkage constant of Ledoit and Wolf (2001), with X the centered data and
+    x0t = sum_i X[t, i]:
+        row_sums_squared: sum_t (sum_i X[t, i]^2)^2
+        fourth_powers:    sum_t X[t, i]^4
+        column_sums:      sum_t X[t, i]
+        weighted_squares: sum_t x0t^2 X[t, i]^2
+    All entries are sums over t, so they can be accumulated over row blocks.
+    Leading dimensions of data_matrix_centered (a stack of data matrices) are kept.
+    """
+    X_squared = data_matrix_centered ** 2
+    row_sums = np.sum(X_squared, axis=-1)
+    x0t = np.sum(data_matrix_centered, axis=-1)
+    return {'row_sums_squared': np.sum(row_sums ** 2, axis=-1),
+            'fourth_powers': np.sum(X_squared ** 2, axis=-2),
+            'column_sums': np.sum(data_matrix_centered, axis=-2),
+            'weighted_squares': np.matmul((x0t ** 2)[..., None, :], X_squared)[..., 0, :]}
+
+
 def compute_frobenius_norm(population_matrix, estimator_matrix):
-    return np.linalg.norm((population_matrix - estimator_matrix), 'fro')
+    return np.linalg.norm((population_matrix - estimator_matrix), 'fro', axis=(-2, -1))
 
 
 def cov_of_two_vec(x, y):
@@ -31,3 +54,33 @@ def cov_of_two_vec(x, y):
 
 def var_of_vector(x):
     return np.sum(np.power(x - np.mean(x), 2))/len(x)
+
+
+def isotonic_regression(y, weights=None):
+    """
+    Weighted least-squares non-decreasing fit of y by the pool adjacent violators
+    algorithm. Blocks are kept on a stack and merged backwards while they violate
+    monotonicity, so every element is pushed and popped at most once: O(n).
+    """
+    y = np.asarray(y, dtype=float)
+    assert y.ndim == 1
+    if weights is None:
+        weights = np.ones(y.shape[0])
+    else:
+        weights = np.asarray(weights, dtype=float)
+        assert weights.shape == y.shape
+
+    block_means = []
+    block_weights = []
+    block_sizes = []
+    for value, weight in zip(y.tolist(), weights.tolist()):
+        mean, total_weight, size = value, weight, 1
+        while block_means and block_means[-1] > mean:
+            previous_weight = block_weights.pop()
+            mean = (block_means.pop()*previous_weight + mean*total_weight) / (previous_weight + total_weight)
+            total_weight += previous_weight
+            size += block_sizes.pop()
+        block_means.append(mean)
+        block_weights.append(total_weight)
+        block_sizes.append(size)
+    return np.repeat(block_means, block_sizes)
@@ -2,8 +2,9 @@
 # Mean-Variance Portfolio Class
 #
 import numpy as np
-import pandas as pd
+import scipy.optimize as sco
 from pylab import plt
+from eod_data import load_eod_data
 
 class mean_variance_portfolio(object):
     def __init__(self, symbols, weigths=None):
@@ -14,28 +15,113 @@ class mean_variance_portfolio(object):
         self.get_data()
 
     def get_data(self):
-        self.raw = pd.read_csv('http://hilpisch.com/tr_eikon_eod_data.csv',
-                               index_col=0, parse_dates=True)
+        self.raw = load_eod_data(self.symbols)
         self.data = self.raw[self.symbols]
         self.rets = np.log(self.data / self.data.shift(1)).dropna()
+        self.calculate_moments()
+
+    def calculate_moments(self):
+        # annualized moments, cached for the batched calculations
+        self.mean_rets = self.rets.mean().values * 252
+        self.cov_rets = self.rets.cov().values * 252
 
     def calculate_port_return(self, weights=None):
         if weights is not None:
             self.weights = weights
-        return np.dot(self.rets.mean() * 252, self.weights)
+        return np.dot(self.mean_rets, self.weights)
 
     def calculate_port_volatility(self, weights=None):
         if weights is not None:
             self.weights = weights
-        return np.dot(self.weights, np.dot(self.rets.cov() * 252,
-                                           self.weights)) ** 0.5
-
-    def simulate_portfolios(self, number=250):
-        pc = np.random.random((number, len(self.symbols)))
-        pc = (pc.T / pc.sum(axis=1)).T
-        vm = [(self.calculate_port_volatility(w),
-               self.calculate_port_return(w)) for w in pc]
-        self.results = np.array(vm)
+        return np.dot(self.weights, np.dot(self.cov_rets, self.weights)) ** 0.5
+
+    def calculate_port_stats(self, weights):
+        # volatilities and returns for a (N x assets) weight matrix
+        weights = np.atleast_2d(weights)
+        rets = weights.dot(self.mean_rets)
+        vols = np.einsum('ij,ij->i', weights.dot(self.cov_rets), weights) ** 0.5
+        return vols, rets
+
+    def simulate_portfolios(self, number=250, chunk_size=100000):
+        # random portfolios are drawn and evaluated chunk by chunk,
+        # so memory beyond the results stays flat for large numbers
+        self.results = np.empty((number, 2))
+        for start in range(0, number, chunk_size):
+            stop = min(start + chunk_size, number)
+            pc = np.random.random((stop - start, len(self.symbols)))
+            pc /= pc.sum(axis=1, keepdims=True)
+            self.results[start:stop, 0], self.results[start:stop, 1] = \
+                self.calculate_port_stats(pc)
+
+    def minimum_variance_portfolio(self, long_only=False):
+        # closed form for fully invested portfolios with short sales,
+        # quadratic optimization for long-only portfolios
+        if long_only:
+            return self.optimize_port_weights(None)
+        ones = np.ones(len(self.symbols))
+        a = np.linalg.solve(self.cov_rets, ones)
+        return a / a.sum()
+
+    def optimize_port_weights(self, target_return=None, start=None,
+                              tolerance=1e-6):
+        # long-only weights with minimal variance (for the target return),
+        # start is an initial guess, e.g. the solution for a nearby target;
+        # raises ValueError if the target cannot be reached long-only
+        noa = len(self.symbols)
+        if start is None:
+            start = np.ones(noa) / noa
+        cons = [{'type': 'eq', 'fun': lambda w: w.sum() - 1,
+                 'jac': lambda w: np.ones(noa)}]
+        if target_return is not None:
+            cons.append({'type': 'eq',
+                         'fun': lambda w: w.dot(self.mean_rets) - target_return,
+                         'jac': lambda w: self.mean_rets})
+        opt = sco.minimize(lambda w: w.dot(self.cov_rets).dot(w), start,
+                           jac=lambda w: 2 * self.cov_rets.dot(w),
+                           method='SLSQP', bounds=noa * [(0, 1)],
+                           constraints=cons)
+        weights = opt['x']
+        if not opt['success']:
+            raise ValueError('Optimization failed: %s' % opt['message'])
+        if (abs(weights.sum() - 1) > tolerance or target_return is not None
+                and abs(weights.dot(self.mean_rets) - target_return)
+                > tolerance):
+            raise ValueError('Target return %s not reachable long-only'
+                             % target_return)
+        return weights
+
+    def efficient_frontier(self, target_returns=None, number=50,
+                           long_only=True):
+        # weights, volatilities and returns of the frontier portfolios;
+        # the default targets run from the minimum variance portfolio
+        # to the highest single asset return; long-only targets that
+        # cannot be reached give rows of NaN
+        if target_returns is None:
+            w_min = self.minimum_variance_portfolio(long_only)
+            target_returns = np.linspace(w_min.dot(self.mean_rets),
+                                         self.mean_rets.max(), number)
+        target_returns = np.asarray(target_returns, dtype=float)
+        if long_only:
+            weights = np.empty((len(target_returns), len(self.symbols)))
+            start = None
+            for i, target_return in enumerate(target_returns):
+                try:
+                    start = self.optimize_port_weights(target_return, start)
+                except ValueError:
+                    weights[i] = np.nan
+                else:
+                    weights[i] = start
+        else:
+            ones = np.ones(len(self.symbols))
+            a = np.linalg.solve(self.cov_rets, ones)
+            b = np.linalg.solve(self.cov_rets, self.mean_rets)
+            A, B, C = ones.dot(a), ones.dot(b), self.mean_rets.dot(b)
+            D = A * C - B ** 2
+            weights = (np.outer(C - B * target_returns, a) +
+                       np.outer(A * target_returns - B, b)) / D
+        vols, rets = self.calculate_port_stats(weights)
+        self.frontier = np.column_stack((vols, rets))
+        return weights, vols, rets
 
     def plot_results(self):
         plt.figure(figsize=(10, 6))
@@ -0,0 +1,151 @@
+#
+# Local Columnar Cache for the Thomson Reuters Eikon EOD Data Set
+#
+# The CSV file is downloaded (or read from a local path) and parsed
+# once; the index and every column are then stored as separate .npy
+# files that are memory-mapped on loading, together with a manifest
+# holding the SHA-256 checksums of the source and of every file.
+#
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import urllib.request
+from io import BytesIO
+
+EOD_DATA_URL = 'http://hilpisch.com/tr_eikon_eod_data.csv'
+CACHE_DIR = os.environ.get('EOD_DATA_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache',
+                                        'tr_eikon_eod_data'))
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_url(source):
+    return source.startswith(('http://', 'https://', 'ftp://'))
+
+
+def cache_path(source, cache_dir=None):
+    """ Returns the cache directory for the given source. """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if not is_url(source):
+        source = os.path.abspath(source)
+    return os.path.join(cache_dir, sha256(source.encode())[:16])
+
+
+def read_source(source):
+    """ Returns the raw bytes of a URL or a local file. """
+    if is_url(source):
+        return urllib.request.urlopen(source).read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_cache(source=EOD_DATA_URL, cache_dir=None):
+    """ Parses the CSV file once and writes the columnar cache.
+
+    Arguments:
+    ==========
+    source: string
+        URL or local path of the CSV file
+
+    cache_dir: string
+        root directory of the cache, defaults to CACHE_DIR
+
+    Returns the manifest of the cache.
+    """
+    path = cache_path(source, cache_dir)
+    raw_bytes = read_source(source)
+    manifest = read_manifest(path)
+    if manifest is not None and manifest['source_sha256'] == sha256(raw_bytes):
+        return manifest
+    raw = pd.read_csv(BytesIO(raw_bytes),
+                      index_col=0, parse_dates=True)
+    tmp_path = path + '.tmp%d' % os.getpid()
+    os.makedirs(tmp_path, exist_ok=True)
+    files = {'index': 'index.npy'}
+    arrays = {'index': raw.index.values.astype('datetime64[ns]')}
+    for i, column in enumerate(raw.columns):
+        # positional file names, symbols such as '.SPX' or 'EUR=' are kept
+        # in the manifest only
+        files[column] = 'column_%03d.npy' % i
+        arrays[column] = raw[column].values.astype(float)
+    checksums = {}
+    for key, array in arrays.items():
+        file_path = os.path.join(tmp_path, files[key])
+        np.save(file_path, array)
+        with open(file_path, 'rb') as f:
+            checksums[key] = sha256(f.read())
+    manifest = {'source': source,
+                'source_sha256': sha256(raw_bytes),
+                'index_name': raw.index.name,
+                'columns': list(raw.columns),
+                'files': files,
+                'checksums': checksums}
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+        os.rmdir(path)
+    os.rename(tmp_path, path)
+    return manifest
+
+
+def load_eod_data(columns=None, source=EOD_DATA_URL, cache_dir=None,
+                  verify=False, refresh=False):
+    """ Returns the EOD data set as pandas DataFrame with DatetimeIndex.
+
+    Arguments:
+    ==========
+    columns: list of strings
+        the columns (symbols) to load, defaults to all columns
+
+    source: string
+        URL or local path of the CSV file; once cached, no network
+        access is needed for URL sources
+
+    cache_dir: string
+        root directory of the cache, defaults to CACHE_DIR
+
+    verify: boolean
+        check the files read against the checksums in the manifest
+
+    refresh: boolean
+        re-read the source and rebuild the cache if it has changed
+    """
+    path = cache_path(source, cache_dir)
+    manifest = read_manifest(path)
+    if manifest is None or refresh:
+        manifest = build_cache(source, cache_dir)
+    if columns is None:
+        columns = manifest['columns']
+    elif isinstance(columns, str):
+        columns = [columns]
+    missing = [column for column in columns
+               if column not in manifest['columns']]
+    if missing:
+        raise KeyError('Columns not in the data set: %s' % ', '.join(missing))
+    arrays = {}
+    for key in ['index'] + list(columns):
+        file_path = os.path.join(path, manifest['files'][key])
+        if verify:
+            with open(file_path, 'rb') as f:
+                if sha256(f.read()) != manifest['checksums'][key]:
+                    raise ValueError('Checksum mismatch for %s, '
+                                     'use refresh=True' % file_path)
+        arrays[key] = np.load(file_path, mmap_mode='r')
+    index = pd.DatetimeIndex(arrays.pop('index'), name=manifest['index_name'])
+    return pd.DataFrame(arrays, index=index, columns=columns)
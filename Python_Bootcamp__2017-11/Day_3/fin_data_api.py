@@ -2,12 +2,14 @@
 # Simple Financial Data API
 # based on Flask
 #
-import pandas as pd
-from flask import Flask, request
+import os
+from flask import Flask, Response, request
+from eod_data import load_eod_data, EOD_DATA_URL
+from frame_buffers import encode_frame, wsgi_blocks, MIMETYPE
 app = Flask(__name__)
 
-raw = pd.read_csv('http://hilpisch.com/tr_eikon_eod_data.csv',
-                 index_col=0, parse_dates=True)
+# set EOD_DATA_SOURCE to a local CSV file to run fully offline
+raw = load_eod_data(source=os.environ.get('EOD_DATA_SOURCE', EOD_DATA_URL))
 
 @app.route('/')
 def main():
@@ -22,6 +24,10 @@ def main():
         return raw[symbols].iloc[-no:].to_html()
     elif out == 'json':
         return raw[symbols].iloc[-no:].to_json()
+    elif out == 'binary':
+        # read with frame_buffers.read_frame
+        return Response(wsgi_blocks(encode_frame(raw[symbols].iloc[-no:])),
+                        mimetype=MIMETYPE)
     else:
         return raw[symbols].iloc[-no:].to_csv()
 
@@ -0,0 +1,121 @@
+#
+# Binary Columnar Encoding of pandas DataFrames
+#
+# Layout: the magic bytes, the length of a JSON header (uint32,
+# little endian), the header itself (rows, index and column names and
+# dtypes) and then the raw little-endian buffers of the index and of
+# every column, each padded to a multiple of 8 bytes. Encoding writes
+# the underlying arrays as they are, decoding creates numpy arrays on
+# top of the received buffer, without text conversion or copies.
+# WSGI servers only accept bytes, so the Flask APIs send the blocks
+# through wsgi_blocks, which copies them block by block.
+#
+import json
+import struct
+import urllib.request
+import numpy as np
+import pandas as pd
+
+MAGIC = b'NPFRAME1'
+MIMETYPE = 'application/vnd.npframe'
+ALIGNMENT = 8
+BLOCK_SIZE = 1 << 16
+
+
+def little_endian(values):
+    """ Returns values as contiguous little-endian array; raises
+    ValueError for dtypes without a fixed-size binary representation """
+    values = np.asarray(values)
+    if values.dtype.kind not in 'biufcmM':
+        raise ValueError('Cannot encode dtype %s' % values.dtype)
+    if values.dtype.kind == 'M':
+        values = values.astype('datetime64[ns]')
+    return np.ascontiguousarray(values,
+                                dtype=values.dtype.newbyteorder('<'))
+
+
+def padding(size):
+    return b'\0' * (-size % ALIGNMENT)
+
+
+def encode_frame(data, block_size=BLOCK_SIZE):
+    """ Generator yielding the encoded DataFrame as bytes and as
+    memoryview blocks of at most block_size bytes of its arrays.
+
+    Arguments:
+    ==========
+    data: pandas DataFrame
+        numeric, boolean or datetime index and columns
+
+    block_size: int
+        maximum size of the memoryview blocks
+    """
+    arrays = [little_endian(data.index.values)]
+    arrays += [little_endian(data[column].values) for column in data.columns]
+    header = {'rows': len(data),
+              'index': {'name': data.index.name,
+                        'dtype': arrays[0].dtype.str},
+              'columns': [{'name': column, 'dtype': array.dtype.str}
+                          for column, array in zip(data.columns,
+                                                   arrays[1:])]}
+    header = json.dumps(header).encode('utf-8')
+    header += padding(len(MAGIC) + 4 + len(header))
+    yield MAGIC + struct.pack('<I', len(header)) + header
+    for array in arrays:
+        view = memoryview(array.view(np.uint8))
+        for i in range(0, len(view), block_size):
+            yield view[i:i + block_size]
+        yield padding(len(view))
+
+
+def wsgi_blocks(chunks):
+    """ Generator yielding the chunks of encode_frame (or text, encoded
+    as UTF-8) as bytes, as required by WSGI servers """
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            yield chunk.encode('utf-8')
+        else:
+            yield bytes(chunk)
+
+
+def decode_arrays(buffer):
+    """ Returns the header, the index array and a dict of the column
+    arrays; the arrays are views of buffer (read-only for bytes) """
+    buffer = memoryview(buffer)
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not an encoded DataFrame')
+    length, = struct.unpack_from('<I', buffer, len(MAGIC))
+    offset = len(MAGIC) + 4
+    header = json.loads(bytes(buffer[offset:offset + length]).rstrip(b'\0'))
+    offset += length
+    arrays = []
+    for dtype in [header['index']['dtype']] + [column['dtype'] for column
+                                               in header['columns']]:
+        dtype = np.dtype(dtype)
+        arrays.append(np.frombuffer(buffer, dtype=dtype,
+                                    count=header['rows'], offset=offset))
+        offset += dtype.itemsize * header['rows']
+        offset += -offset % ALIGNMENT
+    columns = {column['name']: array for column, array
+               in zip(header['columns'], arrays[1:])}
+    return header, arrays[0], columns
+
+
+def decode_frame(buffer):
+    """ Returns the encoded DataFrame; index and columns are views of
+    buffer as long as pandas does not need to convert them """
+    header, index, columns = decode_arrays(buffer)
+    if index.dtype.kind == 'M':
+        index = pd.DatetimeIndex(index, name=header['index']['name'],
+                                 copy=False)
+    else:
+        index = pd.Index(index, name=header['index']['name'], copy=False)
+    return pd.DataFrame(columns, index=index, columns=list(columns),
+                        copy=False)
+
+
+def read_frame(url):
+    """ Requests url (with format=binary) and returns the DataFrame
+    decoded from the response, without copying the arrays """
+    with urllib.request.urlopen(url) as response:
+        return decode_frame(response.read())
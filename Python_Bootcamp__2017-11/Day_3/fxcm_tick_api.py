@@ -2,25 +2,252 @@
 # Simple FXCM Tick Data API
 # based on Flask
 #
+# Responses are serialized and sent in chunks of CHUNK_ROWS rows;
+# large ranges can be pulled page by page with limit and offset or
+# with the cursor returned in the X-Next-Cursor header; X-Total-Count
+# is the number of rows from start to end, X-Page-Count the number
+# of rows in the response. format=binary sends the raw column
+# buffers, see frame_buffers.read_frame.
+#
+# Usage:
+#   python fxcm_tick_api.py          # Flask development server
+#   python fxcm_tick_api.py --async  # asyncio server for many clients
+#
+import asyncio
+import argparse
+import urllib.parse
+import numpy as np
 import pandas as pd
-from flask import Flask, request
+from flask import Flask, Response, abort, request
+from frame_buffers import encode_frame, wsgi_blocks, MIMETYPE
 app = Flask(__name__)
 
 raw = pd.read_hdf('data.h5', 'data')
+if not raw.index.is_monotonic_increasing:
+    raw = raw.sort_index(kind='stable')
+times = np.asarray(raw.index.values, dtype='datetime64[ns]').view(np.int64)
 
-@app.route('/')
-def main():
-    start = request.args['start']
-    end = request.args['end']
-    out = request.args['format']
-    data = raw.loc[start:end]
-    if out == 'html':
-        return data.to_html()
+CHUNK_ROWS = 1000
+BLOCK_SIZE = 1 << 16
+MIMETYPES = {'html': 'text/html', 'json': 'application/json',
+             'csv': 'text/csv', 'binary': MIMETYPE}
+
+
+def encode_cursor(position):
+    """ Cursor of the row at position: its timestamp in nanoseconds
+    and the number of earlier rows with the same timestamp """
+    timestamp = times[position]
+    skip = position - np.searchsorted(times, timestamp, side='left')
+    return '%d-%d' % (timestamp, skip)
+
+
+def decode_cursor(cursor):
+    timestamp, skip = (int(value) for value in cursor.rsplit('-', 1))
+    if skip < 0:
+        raise ValueError('Invalid cursor %s' % cursor)
+    return int(np.searchsorted(times, timestamp, side='left')) + skip
+
+
+def non_negative(args, name):
+    value = int(args.get(name) or 0)
+    if value < 0:
+        raise ValueError('%s must not be negative' % name)
+    return value
+
+
+def parse_time(args, name):
+    """ Returns the start or end argument (None if missing) after
+    checking that pandas can parse it; raises ValueError otherwise """
+    value = args.get(name) or None
+    if value is not None:
+        try:
+            pd.Timestamp(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError('Invalid %s %s' % (name, value))
+    return value
+
+
+class NotFound(Exception):
+    pass
+
+
+def select(args):
+    """ Returns the first and last row positions of the requested page,
+    the number of rows from start to end and the cursor of the next
+    page (None for the last page); raises ValueError for invalid
+    start, end, cursor, offset or limit """
+    start, end = parse_time(args, 'start'), parse_time(args, 'end')
+    try:
+        bounds = raw.index.slice_indexer(start, end)
+    except TypeError:
+        # e.g. time zone given for the naive index
+        raise ValueError('Invalid range %s to %s' % (start, end))
+    begin, last, noop = bounds.indices(len(raw))
+    last = max(begin, last)
+    first = begin
+    if args.get('cursor'):
+        first = max(first, decode_cursor(args['cursor']))
+    first = min(first + non_negative(args, 'offset'), last)
+    if args.get('limit'):
+        stop = min(last, first + non_negative(args, 'limit'))
+    else:
+        stop = last
+    cursor = encode_cursor(stop) if stop < last else None
+    return first, stop, last - begin, cursor
+
+
+def serialize(data, out, chunk_rows=CHUNK_ROWS):
+    """ Generator yielding data in the given format chunk by chunk;
+    csv and json are identical to to_csv() and to_json() """
+    chunks = range(0, len(data), chunk_rows)
+    if out == 'binary':
+        yield from encode_frame(data)
+    elif out == 'html':
+        html = data.iloc[:0].to_html()
+        head, tail = html.split('<tbody>')
+        yield head + '<tbody>\n'
+        for i in chunks:
+            html = data.iloc[i:i + chunk_rows].to_html()
+            yield html.split('<tbody>\n')[1].split('</tbody>')[0]
+        yield '</tbody>' + tail.split('</tbody>')[1]
     elif out == 'json':
-        return data.to_json()
+        yield '{'
+        for j, column in enumerate(data.columns):
+            yield '%s%s:{' % (',' if j else '', pd.Series([column]).to_json(
+                orient='values')[1:-1])
+            for i in chunks:
+                json = data[column].iloc[i:i + chunk_rows].to_json()
+                yield (',' if i else '') + json[1:-1]
+            yield '}'
+        yield '}'
     else:
-        return data.to_csv()
+        yield data.iloc[:0].to_csv()
+        for i in chunks:
+            yield data.iloc[i:i + chunk_rows].to_csv(header=False)
+
+
+def respond(args):
+    """ Returns the headers and the body generator for the query """
+    first, stop, total, cursor = select(args)
+    out = args['format']
+    headers = {'X-Total-Count': str(total),
+               'X-Page-Count': str(stop - first)}
+    if cursor is not None:
+        headers['X-Next-Cursor'] = cursor
+    return headers, MIMETYPES.get(out, 'text/csv'), serialize(
+        raw.iloc[first:stop], out)
+
+
+@app.route('/')
+def main():
+    try:
+        headers, mimetype, body = respond(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+    return Response(wsgi_blocks(body), mimetype=mimetype,
+                    headers=headers)
+
+
+def next_block(chunks, size=BLOCK_SIZE):
+    """ Joins the next chunks, text encoded as UTF-8, up to at least
+    size bytes; returns empty bytes once the chunks are exhausted """
+    block, length = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        block.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            break
+    return b''.join(block)
+
+
+async def iterate_blocks(body, loop):
+    """ Asynchronous generator over the body; generators are advanced
+    in the default executor, one block at a time, so that a small
+    response needs a single round trip to the executor """
+    if isinstance(body, list):
+        for chunk in body:
+            yield chunk
+        return
+    while True:
+        block = await loop.run_in_executor(None, next_block, body)
+        if not block:
+            return
+        yield block
+
+
+async def handle_client(reader, writer):
+    """ Serves the HTTP/1.1 requests of one connection; every chunk is
+    serialized in the default executor and sent with back pressure,
+    so slow clients do not block the others """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            request_headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, value = line.decode('latin-1').split(':', 1)
+                request_headers[name.strip().lower()] = value.strip()
+            keep_alive = (version == 'HTTP/1.1' and
+                          request_headers.get('connection') != 'close')
+            url = urllib.parse.urlsplit(target)
+            args = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                if method != 'GET' or url.path != '/':
+                    raise NotFound
+                headers, mimetype, body = respond(args)
+                status = '200 OK'
+            except NotFound:
+                status, headers, mimetype = '404 Not Found', {}, 'text/plain'
+                body = ['Not Found']
+            except (KeyError, ValueError) as e:
+                status, headers, mimetype = ('400 Bad Request', {},
+                                             'text/plain')
+                body = ['Bad Request: %s' % e]
+            if mimetype.startswith('text/') or mimetype.endswith('json'):
+                mimetype += '; charset=utf-8'
+            head = ['HTTP/1.1 %s' % status,
+                    'Content-Type: %s' % mimetype,
+                    'Transfer-Encoding: chunked',
+                    'Connection: %s' % ('keep-alive' if keep_alive
+                                        else 'close')]
+            head += ['%s: %s' % item for item in headers.items()]
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            async for chunk in iterate_blocks(body, loop):
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if chunk:
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    await writer.drain()
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_async(host='0.0.0.0', port=5555):
+    server = await asyncio.start_server(handle_client, host, port)
+    async with server:
+        await server.serve_forever()
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5555, debug=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='serve with the asyncio server')
+    args = parser.parse_args()
+    if args.use_async:
+        asyncio.run(serve_async(port=5555))
+    else:
+        app.run(host='0.0.0.0', port=5555, debug=True)
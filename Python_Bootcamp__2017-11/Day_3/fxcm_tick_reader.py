@@ -16,10 +16,177 @@
 # Status: Experimental
 #
 import gzip
-import pandas as pd
+import time
+import threading
+import http.client
+import urllib.error
+import urllib.parse
 import urllib.request
+import itertools
+import collections
+import numpy as np
+import pandas as pd
 import datetime as dt
 from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fxcm_tick_cache import TickCache, is_closed
+
+FXCM_TICK_URL = 'https://tickdata.fxcorporate.com/%s/%s/%s.csv.gz'
+MAX_REDIRECTS = 10
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# byte offsets of the separators in 'MM/DD/YYYY HH:MM:SS.fff'
+TIMESTAMP_SEPARATORS = {2: b'/', 5: b'/', 10: b' ', 13: b':', 16: b':',
+                        19: b'.'}
+TIMESTAMP_WIDTH = 23
+
+
+def parse_timestamps(text, starts):
+    """ Parses the fixed-width timestamps beginning at the positions
+    starts of the ASCII byte array text; returns int64 nanoseconds """
+    for offset, char in TIMESTAMP_SEPARATORS.items():
+        if (text[starts + offset] != ord(char)).any():
+            raise ValueError('Unexpected timestamp format')
+
+    def number(first, width):
+        value = np.zeros(len(starts), dtype=np.int64)
+        for position in range(first, first + width):
+            digit = text[starts + position].astype(np.int64) - 48
+            if ((digit < 0) | (digit > 9)).any():
+                raise ValueError('Unexpected timestamp format')
+            value = value * 10 + digit
+        return value
+
+    months = (number(6, 4) - 1970) * 12 + number(0, 2) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]')
+    days = days.astype(np.int64) + number(3, 2) - 1
+    seconds = (days * 24 + number(11, 2)) * 3600
+    seconds += number(14, 2) * 60 + number(17, 2)
+    return seconds * 1000000000 + number(20, 3) * 1000000
+
+
+def parse_decimals(text, starts, ends):
+    """ Parses the plain decimal numbers text[starts:ends] (optional
+    sign, digits and decimal point) into a float array; the integer
+    mantissa is divided by a power of ten, which rounds exactly like
+    the CSV parser as long as the mantissa has at most 15 digits """
+    widths = ends - starts
+    last = len(text) - 1
+    mantissa = np.zeros(len(starts), dtype=np.int64)
+    digits = np.zeros(len(starts), dtype=np.int64)
+    decimals = np.zeros(len(starts), dtype=np.int64)
+    seen_dot = np.zeros(len(starts), dtype=bool)
+    negative = np.zeros(len(starts), dtype=bool)
+    for position in range(widths.max(initial=0)):
+        inside = position < widths
+        char = np.where(inside, text[np.minimum(starts + position, last)], 0)
+        is_digit = inside & (char >= 48) & (char <= 57)
+        is_dot = inside & (char == 46)
+        is_sign = inside & (char == 45) & (position == 0)
+        if (inside & ~(is_digit | is_dot | is_sign)).any() or \
+                (is_dot & seen_dot).any():
+            raise ValueError('Unexpected number format')
+        mantissa = np.where(is_digit, mantissa * 10 + char - 48, mantissa)
+        digits += is_digit
+        decimals += is_digit & seen_dot
+        seen_dot |= is_dot
+        negative |= is_sign
+    if (digits > 15).any():
+        raise ValueError('Too many digits for exact parsing')
+    values = mantissa / 10. ** decimals
+    values[negative] *= -1
+    values[digits == 0] = np.nan
+    return values
+
+
+def parse_tick_data(raw, chunk_size=1 << 22):
+    """ Parses a gzip compressed, UTF-16 encoded FXCM tick data file.
+
+    The file is decompressed chunk by chunk; the UTF-16 code units are
+    reduced to ASCII bytes (raising ValueError for any other character)
+    and the complete lines of each chunk are parsed into int64
+    nanoseconds and float arrays, without building Python strings.
+
+    Arguments:
+    ==========
+    raw: bytes
+        content of the .csv.gz file
+
+    chunk_size: int
+        number of decompressed bytes processed at a time
+
+    Returns a pandas DataFrame with DatetimeIndex.
+    """
+    f = gzip.GzipFile(fileobj=BytesIO(raw))
+    pending = f.read(2)
+    if pending == b'\xff\xfe':
+        low, pending = 0, b''
+    elif pending == b'\xfe\xff':
+        low, pending = 1, b''
+    else:
+        # no byte order mark, decode('utf-16') assumes little endian
+        low = 0
+    names = None
+    rest = np.empty(0, dtype=np.uint8)
+    index, columns = [], []
+    while True:
+        block = f.read(chunk_size)
+        if block:
+            block = pending + block
+            size = len(block) - len(block) % 2
+            pending = block[size:]
+            units = np.frombuffer(block, dtype=np.uint8, count=size)
+            units = units.reshape(-1, 2)
+            if units[:, 1 - low].any():
+                raise ValueError('Non-ASCII characters in tick data')
+            text = np.concatenate((rest, units[:, low]))
+        else:
+            if pending:
+                raise ValueError('Truncated UTF-16 data')
+            # the last line may lack a line break
+            text = rest
+            if len(text) and text[-1] != 10:
+                text = np.append(text, np.uint8(10))
+        newlines = np.flatnonzero(text == 10)
+        if names is None and len(newlines):
+            header = text[:newlines[0]].tobytes().decode('ascii')
+            names = header.strip().split(',')
+            text = text[newlines[0] + 1:]
+            newlines = newlines[1:] - newlines[0] - 1
+        if len(newlines) == 0:
+            rest = text
+            if block:
+                continue
+            break
+        rest = text[newlines[-1] + 1:]
+        text = text[:newlines[-1] + 1]
+        starts = np.concatenate(([0], newlines[:-1] + 1))
+        ends = newlines.copy()
+        ends[text[np.maximum(ends - 1, 0)] == 13] -= 1
+        starts, ends = starts[ends > starts], ends[ends > starts]
+        commas = np.flatnonzero(text == 44)
+        counts = np.diff(np.searchsorted(commas, np.concatenate(
+            (starts[:1], ends))))
+        if (counts != len(names) - 1).any():
+            raise ValueError('Unexpected number of fields')
+        commas = commas.reshape(len(starts), len(names) - 1)
+        if (commas[:, 0] - starts != TIMESTAMP_WIDTH).any():
+            raise ValueError('Unexpected timestamp format')
+        index.append(parse_timestamps(text, starts))
+        bounds = np.column_stack((commas, ends))
+        columns.append([parse_decimals(text, bounds[:, i] + 1,
+                                       bounds[:, i + 1])
+                        for i in range(len(names) - 1)])
+        if not block:
+            break
+    if names is None:
+        raise ValueError('Empty tick data file')
+    index = np.concatenate(index) if index else np.empty(0, dtype=np.int64)
+    data = {name: (np.concatenate([chunk[i] for chunk in columns])
+                   if columns else np.empty(0))
+            for i, name in enumerate(names[1:])}
+    return pd.DataFrame(data, index=pd.DatetimeIndex(
+        index.view('datetime64[ns]'), name=names[0]), columns=names[1:])
 
 
 class fxcm_tick_reader(object):
@@ -30,7 +197,9 @@ class fxcm_tick_reader(object):
                'GBPNZD', 'GBPUSD', 'GBPCHF', 'GBPJPY', 'GBPNZD', 'NZDCAD',
                'NZDCHF', 'NZDJPY', 'NZDUSD', 'USDCAD', 'USDCHF', 'USDJPY')
 
-    def __init__(self, symbol, start, stop):
+    def __init__(self, symbol, start, stop, max_workers=4, retries=3,
+                 backoff=0.5, timeout=60, url=FXCM_TICK_URL, cache=True,
+                 fetch=True, parser='fast'):
         """ Constructor of the class.
 
         Arguments:
@@ -44,6 +213,36 @@ class fxcm_tick_reader(object):
         stop: datetime.date
             the last day to retrieve data for
 
+        max_workers: int
+            maximum number of weeks downloaded at the same time
+
+        retries: int
+            number of retries for a week after a connection error
+            or a 5xx response
+
+        backoff: float
+            seconds to wait before the first retry, doubled for
+            every further retry
+
+        timeout: float
+            socket timeout in seconds
+
+        url: string
+            URL template with placeholders for symbol, year and week,
+            e.g. pointing to a local stand-in server
+
+        cache: boolean or TickCache
+            True uses the default on-disk week cache, False disables
+            caching; closed weeks found in the cache are not downloaded
+
+        fetch: boolean
+            retrieve the whole time window at construction; with False,
+            use iter_weeks() or fetch on the first data access
+
+        parser: string
+            'fast' for parse_tick_data, falling back to pandas for
+            files it cannot handle, or 'pandas' for read_csv only
+
         """
 
         if not (isinstance(start, dt.datetime) or isinstance(start, dt.date)):
@@ -66,59 +265,392 @@ class fxcm_tick_reader(object):
         else:
             self.symbol = symbol
 
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        if parser not in ('fast', 'pandas'):
+            raise ValueError("parser must be 'fast' or 'pandas'")
+        self.parser = parser
+
+        if cache is True:
+            cache = TickCache()
+        self.cache = cache or None
+
         self.data = None
-        self.url = 'https://tickdata.fxcorporate.com/%s/%s/%s.csv.gz'
-        self.__fetch_data__()
+        self.times = None
+        self.url = url
+        if fetch:
+            self.__fetch_data__()
 
     def get_raw_data(self):
         """ Returns the raw data set as pandas DataFrame """
+        if self.data is None:
+            self.__fetch_data__()
         return self.data
 
     def get_data(self, start=None, end=None):
         """ Returns the requested data set as pandas DataFrame;
-        DataFrame index is converted to DatetimeIndex object """
-        try:
-            self.data_adj
-        except:
-            data = self.data.copy()
-            index = pd.to_datetime(data.index.values,
-                                   format='%m/%d/%Y %H:%M:%S.%f')
-            data.index = index
-            self.data_adj = data
-        data = self.data_adj
+        DataFrame index is converted to DatetimeIndex object.
+
+        The ticks from start to end (both inclusive) are found by
+        binary search on the sorted index and returned as a slice
+        of the raw data, without copying. """
+        if self.times is None:
+            self.__index_data__()
+        first, last = 0, len(self.times)
         if start is not None:
-            data = data[data.index >= start]
+            first = np.searchsorted(self.times, self.__to_ns__(start),
+                                    side='left')
         if end is not None:
-            data = data[data.index <= end]
-        return data
+            last = np.searchsorted(self.times, self.__to_ns__(end),
+                                   side='right')
+        return self.data.iloc[first:max(first, last)]
+
+    @staticmethod
+    def __to_ns__(timestamp):
+        """ Returns the timestamp as int64 nanoseconds """
+        value = pd.Timestamp(timestamp).to_datetime64()
+        return value.astype('datetime64[ns]').astype(np.int64)
+
+    def __index_data__(self):
+        """ Converts the index of the raw data in place to a sorted
+        datetime64[ns] index and keeps its int64 view in self.times """
+        data = self.get_raw_data()
+        index = data.index
+        if not isinstance(index, pd.DatetimeIndex):
+            index = pd.to_datetime(index.values,
+                                   format='%m/%d/%Y %H:%M:%S.%f')
+        values = np.asarray(index.values, dtype='datetime64[ns]')
+        times = values.view(np.int64)
+        if (times[1:] < times[:-1]).any():
+            order = np.argsort(times, kind='stable')
+            data = data.iloc[order]
+            values, times = values[order], times[order]
+        data.index = pd.DatetimeIndex(values, name=data.index.name)
+        self.data = data
+        self.times = times
 
     @classmethod
     def get_available_symbols(cls):
         """ Returns all available symbols """
         return cls.symbols
 
-    def __fetch_data__(self):
-        """ Retrieve the data for the given symbol and the given time window """
-        self.data = pd.DataFrame()
+    def get_weeks(self):
+        """ Returns the (ISO year, ISO week) pairs of the time window """
+        weeks = []
         running_date = self.start
         seven_days = dt.timedelta(days=7)
         while running_date <= self.stop:
             year, week, noop = running_date.isocalendar()
-            url = self.url % (self.symbol, year, week)
-            data = self.__fetch_dataset__(url)
-            if len(self.data) == 0:
-                self.data = data
-            else:
-                self.data = pd.concat((self.data, data))
+            weeks.append((year, week))
             running_date = running_date + seven_days
+        return weeks
+
+    def iter_weeks(self, ordered=True):
+        """ Generator yielding the weeks of the time window as pandas
+        DataFrames while they arrive; at most max_workers weeks are
+        requested ahead, so memory stays proportional to a few weeks.
+
+        Arguments:
+        ==========
+        ordered: boolean
+            yield the weeks in calendar order, otherwise in the order
+            the downloads finish
+        """
+        weeks = iter(self.get_weeks())
+        pending = collections.deque()
+        self.__open_session__()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for year_week in itertools.islice(weeks, self.max_workers):
+                pending.append(executor.submit(self.__fetch_week__,
+                                               year_week))
+            while pending:
+                if ordered:
+                    future = pending.popleft()
+                else:
+                    done, noop = wait(pending, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
+                data = future.result()
+                for year_week in itertools.islice(weeks, 1):
+                    pending.append(executor.submit(self.__fetch_week__,
+                                                   year_week))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            self.__close_session__()
+            if self.cache is not None:
+                self.cache.save()
+
+    def __fetch_data__(self):
+        """ Retrieve the data for the given symbol and the given time window """
+        self.__set_data__(list(self.iter_weeks()))
+
+    def __set_data__(self, weeks):
+        """ Sets the raw data to the given week DataFrames """
+        # a single concatenation, linear in the number of ticks
+        self.data = pd.concat(weeks)
+        self.times = None
+
+    def __open_session__(self, session=None):
+        """ Sets up the keep-alive connections of the worker threads;
+        readers given the same session share the connections """
+        if session is None:
+            session = (threading.local(), [], threading.Lock())
+        self._local, self._connections, self._lock = session
+        return session
+
+    def __close_session__(self):
+        """ Closes the connections of the session """
+        for connection in self._connections:
+            connection.close()
+        del self._local, self._connections, self._lock
+
+    def __fetch_week__(self, year_week):
+        """ Returns one week from the cache or the server """
+        year, week = year_week
+        if self.cache is not None:
+            data = self.cache.load(self.symbol, year, week)
+            if data is not None:
+                return data
+        data = self.__fetch_dataset__(self.url % (self.symbol, year, week))
+        if self.cache is not None and is_closed(year, week):
+            self.cache.store(self.symbol, year, week, data)
+        return data
+
+    def __get_connection__(self, parts):
+        """ Returns the keep-alive connection of the calling thread """
+        connections = self._local.__dict__.setdefault('connections', {})
+        key = (parts.scheme, parts.netloc)
+        if key not in connections:
+            if parts.scheme == 'https':
+                connection = http.client.HTTPSConnection(
+                    parts.netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(
+                    parts.netloc, timeout=self.timeout)
+            connections[key] = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connections[key]
+
+    def __download__(self, url):
+        """ Returns the body of the response, retrying on connection
+        errors and 5xx responses """
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                status, reason, headers, body = self.__request__(url)
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+                continue
+            if status == 200:
+                return body
+            error = urllib.error.HTTPError(url, status, reason, headers, None)
+            if status < 500:
+                raise error
+        raise error
+
+    def __request__(self, url):
+        """ GET request on the keep-alive connection of the host,
+        following up to MAX_REDIRECTS redirects like urlopen; returns
+        status, reason, headers and body of the last response. URLs
+        with a proxy set in the environment (HTTP_PROXY, HTTPS_PROXY,
+        NO_PROXY) are requested through urlopen, without keep-alive """
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme in urllib.request.getproxies() and \
+                    not urllib.request.proxy_bypass(parts.hostname):
+                try:
+                    with urllib.request.urlopen(
+                            url, timeout=self.timeout) as response:
+                        return (response.status, response.reason,
+                                response.headers, response.read())
+                except urllib.error.HTTPError as e:
+                    return e.code, e.reason, e.headers, e.read()
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            connection = self.__get_connection__(parts)
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                # the server may have dropped the idle connection
+                connection.close()
+                raise
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_CODES or location is None:
+                break
+            url = urllib.parse.urljoin(url, location)
+            if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+                break
+        return response.status, response.reason, response.headers, body
 
     def __fetch_dataset__(self, url):
         """ Retrieve data for the given symbol for one week """
         print('Fetching data from: %s' % url)
-        requests = urllib.request.urlopen(url)
-        buf = BytesIO(requests.read())
+        raw = self.__download__(url)
+        if self.parser == 'fast':
+            try:
+                return parse_tick_data(raw)
+            except ValueError:
+                pass
+        buf = BytesIO(raw)
         f = gzip.GzipFile(fileobj=buf)
         data = f.read()
         data_str = data.decode('utf-16')
         data_pandas = pd.read_csv(StringIO(data_str), index_col=0)
+        data_pandas.index = pd.to_datetime(data_pandas.index,
+                                           format='%m/%d/%Y %H:%M:%S.%f')
         return data_pandas
+
+
+class fxcm_panel_reader(object):
+    """ A class to retrieve historical tick data for several symbols,
+    fetching and parsing all (symbol, week) units on one worker pool. """
+
+    def __init__(self, symbols=None, start=None, stop=None, max_workers=8,
+                 cache=True, **kwargs):
+        """ Constructor of the class.
+
+        Arguments:
+        ==========
+        symbols: list of strings
+            symbols out of fxcm_tick_reader.symbols, defaults to all
+
+        start: datetime.date
+            the first day to retrieve data for
+
+        stop: datetime.date
+            the last day to retrieve data for
+
+        max_workers: int
+            size of the worker pool shared by all symbols
+
+        cache: boolean or TickCache
+            as for fxcm_tick_reader, one cache is shared by all symbols
+
+        kwargs:
+            further arguments for fxcm_tick_reader, e.g. url or retries
+        """
+        if symbols is None:
+            symbols = list(dict.fromkeys(fxcm_tick_reader.symbols))
+        elif isinstance(symbols, str):
+            symbols = [symbols]
+        if cache is True:
+            cache = TickCache()
+        self.symbols = list(symbols)
+        self.max_workers = max_workers
+        self.readers = {symbol: fxcm_tick_reader(symbol, start, stop,
+                                                 max_workers=max_workers,
+                                                 cache=cache, fetch=False,
+                                                 **kwargs)
+                        for symbol in self.symbols}
+        self.cache = cache or None
+        self.__fetch_data__()
+
+    def __fetch_data__(self):
+        """ Retrieve the data of all symbols on a shared worker pool """
+        units = [(reader, year_week) for reader in self.readers.values()
+                 for year_week in reader.get_weeks()]
+        session = None
+        for reader in self.readers.values():
+            session = reader.__open_session__(session)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                weeks = list(executor.map(
+                    lambda unit: unit[0].__fetch_week__(unit[1]), units))
+        finally:
+            for reader in self.readers.values():
+                reader.__close_session__()
+            if self.cache is not None:
+                self.cache.save()
+        for reader in self.readers.values():
+            count = len(reader.get_weeks())
+            reader.__set_data__(weeks[:count])
+            del weeks[:count]
+
+    def get_reader(self, symbol):
+        """ Returns the fxcm_tick_reader object of the symbol """
+        return self.readers[symbol]
+
+    def get_data(self, start=None, end=None):
+        """ Returns the ticks of all symbols in long format as pandas
+        DataFrame with DatetimeIndex, sorted by time, and a categorical
+        Symbol column """
+        frames = [self.readers[symbol].get_data(start, end)
+                  for symbol in self.symbols]
+        columns = list(frames[0].columns)
+        times = np.concatenate([frame.index.values for frame in frames])
+        codes = np.repeat(np.arange(len(frames), dtype=np.int16),
+                          [len(frame) for frame in frames])
+        order = np.argsort(times, kind='stable')
+        data = {'Symbol': pd.Categorical.from_codes(codes[order],
+                                                    categories=self.symbols)}
+        for column in columns:
+            values = np.concatenate([frame[column].values
+                                     for frame in frames])
+            data[column] = values[order]
+        index = pd.DatetimeIndex(times[order], name=frames[0].index.name)
+        return pd.DataFrame(data, index=index, columns=['Symbol'] + columns)
+
+    def get_panel(self, freq='1min', start=None, end=None, tolerance=None):
+        """ Returns an as-of aligned wide panel: for every point of a
+        common time grid the last tick at or before it, per symbol.
+
+        Arguments:
+        ==========
+        freq: string
+            frequency of the time grid, e.g. '1s' or '5min'
+
+        start, end: datetime-like
+            first and last grid points, default to the first and last
+            tick over all symbols, rounded to freq
+
+        tolerance: string or pandas Timedelta
+            maximum age of a tick; older values are NaN
+
+        Returns a pandas DataFrame with the grid as DatetimeIndex and
+        (symbol, column) pairs as columns.
+        """
+        readers = [self.readers[symbol] for symbol in self.symbols]
+        for reader in readers:
+            if reader.times is None:
+                reader.__index_data__()
+        if start is None:
+            start = pd.Timestamp(min(reader.times[0] for reader in readers
+                                     if len(reader.times))).ceil(freq)
+        if end is None:
+            end = pd.Timestamp(max(reader.times[-1] for reader in readers
+                                   if len(reader.times))).floor(freq)
+        grid = pd.date_range(start, end, freq=freq)
+        grid_ns = np.asarray(grid.values, dtype='datetime64[ns]')
+        grid_ns = grid_ns.view(np.int64)
+        if tolerance is not None:
+            tolerance = pd.Timedelta(tolerance).value
+        panel = {}
+        for symbol, reader in zip(self.symbols, readers):
+            position = np.searchsorted(reader.times, grid_ns,
+                                       side='right') - 1
+            missing = (position < 0) | (len(reader.times) == 0)
+            if tolerance is not None:
+                times = np.append(reader.times, 0)
+                age = grid_ns - times[np.maximum(position, 0)]
+                missing |= age > tolerance
+            for column in reader.data.columns:
+                values = np.append(reader.data[column].values, np.nan)
+                values = values[np.maximum(position, 0)]
+                panel[(symbol, column)] = np.where(missing, np.nan, values)
+        panel = pd.DataFrame(panel, index=grid)
+        panel.columns.names = ['Symbol', None]
+        return panel
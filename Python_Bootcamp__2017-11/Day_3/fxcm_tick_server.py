@@ -0,0 +1,198 @@
+#
+# Local Stand-in for the FXCM Tick Data Server
+#
+# Serves weekly .csv.gz files from a local directory under the same
+# URL layout as tickdata.fxcorporate.com (/symbol/year/week.csv.gz),
+# with an optional delay and failing first requests, so that the
+# concurrent download of fxcm_tick_reader can be tested offline.
+#
+# Usage:
+#   python fxcm_tick_server.py fixtures --port 8765 --delay 0.2
+#
+import os
+import gzip
+import time
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import datetime as dt
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def write_fixture(directory, symbol, year, week, ticks=1000, seed=None):
+    """ Writes one week of random tick data in the FXCM file format
+    (UTF-16 CSV, gzip compressed) and returns the file path.
+
+    Arguments:
+    ==========
+    directory: string
+        root directory of the fixture files
+
+    symbol: string
+        symbol, e.g. 'EURUSD'
+
+    year, week: int
+        ISO year and ISO week
+
+    ticks: int
+        number of ticks in the week
+
+    seed: int
+        seed of the random number generator
+    """
+    rng = np.random.default_rng(seed)
+    # FXCM weeks run from Sunday 22:00 to Friday 22:00 (UTC)
+    monday = dt.datetime.fromisocalendar(year, week, 1)
+    first = np.datetime64(monday - dt.timedelta(hours=2), 'ms')
+    offsets = np.sort(rng.integers(0, 5 * 24 * 3600 * 1000, ticks))
+    index = pd.DatetimeIndex(first + offsets.astype('timedelta64[ms]'))
+    bid = 1.15 + np.cumsum(rng.normal(0, 0.00005, ticks))
+    ask = bid + rng.integers(1, 50, ticks) / 1e5
+    data = pd.DataFrame({'Bid': bid.round(5), 'Ask': ask.round(5)},
+                        index=index.strftime('%m/%d/%Y %H:%M:%S.%f').str[:-3])
+    data.index.name = 'DateTime'
+    path = os.path.join(directory, symbol, str(year))
+    os.makedirs(path, exist_ok=True)
+    path = os.path.join(path, '%d.csv.gz' % week)
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(data.to_csv().encode('utf-16')))
+    return path
+
+
+def write_fixtures(directory, symbol, start, stop, ticks=1000, seed=0):
+    """ Writes the fixture files for all weeks fxcm_tick_reader requests
+    for the given time window; returns the list of file paths. """
+    paths = []
+    running_date = start
+    while running_date <= stop:
+        year, week, noop = running_date.isocalendar()
+        paths.append(write_fixture(directory, symbol, year, week,
+                                   ticks, seed=(seed, year, week)))
+        running_date = running_date + dt.timedelta(days=7)
+    return paths
+
+
+class TickDataHandler(BaseHTTPRequestHandler):
+    """ Serves the files below server.directory, HTTP/1.1 keep-alive """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            failing = server.requests[self.path] <= server.failures
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            parts = self.path.split('?')[0].split('/')
+            path = os.path.join(server.directory, *parts)
+            if failing:
+                self.send_error(503)
+            elif '..' in parts or not os.path.isfile(path):
+                self.send_error(404)
+            else:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class TickDataServer(ThreadingHTTPServer):
+    """ Threaded stand-in server keeping request statistics.
+
+    Arguments:
+    ==========
+    directory: string
+        root directory of the fixture files
+
+    port: int
+        port to listen on, 0 picks a free port
+
+    delay: float
+        seconds every request is delayed, simulating latency
+
+    failures: int
+        number of 503 responses before a file is served, per path
+
+    Attributes:
+    ===========
+    url: string
+        URL template to be passed to fxcm_tick_reader
+
+    requests: Counter
+        number of requests per path
+
+    connections: int
+        number of TCP connections accepted
+
+    max_in_flight: int
+        maximum number of requests handled at the same time
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory, port=0, delay=0., failures=0,
+                 verbose=False):
+        super().__init__(('127.0.0.1', port), TickDataHandler)
+        self.directory = os.path.abspath(directory)
+        self.delay = delay
+        self.failures = failures
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.url = 'http://127.0.0.1:%d/%%s/%%s/%%s.csv.gz' % (
+            self.server_address[1])
+
+    def start(self):
+        """ Serves in a daemon thread; returns the server """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the FXCM tick data server')
+    parser.add_argument('directory')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.)
+    parser.add_argument('--failures', type=int, default=0)
+    args = parser.parse_args()
+    server = TickDataServer(args.directory, args.port, args.delay,
+                            args.failures, verbose=True)
+    print('Serving %s, url=%s' % (server.directory, server.url))
+    server.serve_forever()
@@ -3,46 +3,147 @@
 #
 # FPQ Bootcamp
 #
+import os
+import time
 import numpy as np
 import pandas as pd
 from pylab import plt
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.svm import SVC
 from sklearn import linear_model
 from sklearn.naive_bayes import GaussianNB
+from sklearn.base import is_classifier
+from eod_data import load_eod_data, EOD_DATA_URL
+
+models = ('LinearRegression', 'NaiveBayes', 'LogisticRegression', 'SVC')
+
+
+def create_algorithm(model):
+    if model == 'LinearRegression':
+        return linear_model.LinearRegression()
+    elif model == 'NaiveBayes':
+        return GaussianNB()
+    elif model == 'LogisticRegression':
+        return linear_model.LogisticRegression()
+    elif model == 'SVC':
+        return SVC()
+    return None
+
+
+def create_online_algorithm(model):
+    # incremental (partial_fit) counterparts of the models above
+    if model == 'LinearRegression':
+        return linear_model.SGDRegressor()
+    elif model == 'NaiveBayes':
+        return GaussianNB()
+    elif model == 'LogisticRegression':
+        return linear_model.SGDClassifier(loss='log_loss')
+    elif model == 'SVC':
+        return linear_model.SGDClassifier(loss='hinge')
+    return None
+
+
+# worker side of the process pools: the feature matrix is attached
+# from shared memory once per worker process
+_shared = {}
+
+
+def _attach_shared_array(name, shape):
+    _shared['memory'] = shared_memory.SharedMemory(name=name)
+    _shared['array'] = np.ndarray(shape, dtype=float,
+                                  buffer=_shared['memory'].buf)
+
+
+def _fit_fold(task):
+    # columns of the shared array: returns, then the lag features
+    model, train_start, train_end, test_start, test_end = task
+    array = _shared['array']
+    algorithm = create_algorithm(model)
+    algorithm.fit(array[train_start:train_end, 1:],
+                  np.sign(array[train_start:train_end, 0]))
+    return algorithm.predict(array[test_start:test_end, 1:])
+
+
+def _run_combination(task):
+    # in-sample fit and prediction as in run_strategy, on the first
+    # lags feature columns of the symbol's slice of the shared array
+    symbol, index, num_rows, model, lags = task
+    array = _shared['array'][index, :num_rows]
+    returns = array[:, 0]
+    features = array[:, 1:lags + 1]
+    algorithm = create_algorithm(model)
+    algorithm.fit(features, np.sign(returns))
+    prediction = algorithm.predict(features)
+    return {'symbol': symbol, 'model': model, 'lags': lags,
+            'Returns': np.exp(returns.sum()),
+            'Strategy': np.exp((prediction * returns).sum()),
+            'hit_ratio': (np.sign(prediction) == np.sign(returns)).mean()}
+
+
+def walk_forward_folds(length, train_size, test_size, window='expanding'):
+    """ Returns (train_start, train_end, test_start, test_end) tuples;
+    the training window either grows from the first row ('expanding')
+    or keeps the last train_size rows ('rolling'). """
+    if window not in ('expanding', 'rolling'):
+        raise ValueError('window must be expanding or rolling')
+    folds = []
+    for test_start in range(train_size, length, test_size):
+        train_start = 0 if window == 'expanding' else test_start - train_size
+        folds.append((train_start, test_start, test_start,
+                      min(test_start + test_size, length)))
+    return folds
 
 
 class ScikitBacktester(object):
-    def __init__(self):
-        self.data_url = 'http://hilpisch.com/tr_eikon_eod_data.csv'
+    def __init__(self, data_url=EOD_DATA_URL, symbols=None):
+        # data_url can also be a local path, symbols restricts the
+        # columns loaded from the cache
+        self.data_url = data_url
+        self.symbols = symbols
         self.get_raw_data()
 
     def get_raw_data(self):
-        self.raw_data = pd.read_csv(self.data_url,
-                                    index_col=0,
-                                    parse_dates=True)
+        self.raw_data = load_eod_data(self.symbols, source=self.data_url)
+        self.lag_cache = {}
 
     def get_algorithm(self, model):
         self.model = model
-        if self.model == 'LinearRegression':
-            self.algorithm = linear_model.LinearRegression()
-        elif self.model == 'NaiveBayes':
-            self.algorithm = GaussianNB()
-        elif self.model == 'LogisticRegression':
-            self.algorithm = linear_model.LogisticRegression()
-        elif self.model == 'SVC':
-            self.algorithm = SVC()
-        else:
+        algorithm = create_algorithm(model)
+        if algorithm is None:
             return 'Model not known.'
+        self.algorithm = algorithm
+
+    def get_lag_features(self, symbol, start, end, lags):
+        """ Returns the index, the log returns and the binary lag matrix
+        (int8, column k - 1 holding lag k) for the given date range.
+
+        The full lag matrix of a symbol is computed once with a sliding
+        window over the sign of the returns and memoized together with
+        its number of lags; smaller lag counts and date ranges are served
+        as views of the cached arrays.
+        """
+        cached = self.lag_cache.get(symbol)
+        if cached is None or cached[0] < lags:
+            prices = self.raw_data[symbol]
+            returns = np.log(prices / prices.shift(1)).values
+            positive = (returns > 0).astype(np.int8)
+            padded = np.concatenate((np.zeros(lags, dtype=np.int8), positive))
+            windows = np.lib.stride_tricks.sliding_window_view(padded, lags)
+            cached = (lags, prices.index, returns, windows[:len(returns), ::-1])
+            self.lag_cache[symbol] = cached
+        index, returns, lag_matrix = cached[1:]
+        rows = index.slice_indexer(start, end)
+        return index[rows], returns[rows], lag_matrix[rows, :lags]
 
     def prepare_data(self, symbol, start, end, lags):
-        data = pd.DataFrame(self.raw_data[symbol])
-        data['Returns'] = np.log(data / data.shift(1))
-        self.cols = []
-        for lag in range(1, lags + 1):
-            col = 'lag_%d' % lag
-            data[col] = np.where(data['Returns'].shift(lag) > 0, 1, 0)
-            self.cols.append(col)
-        self.data = data.loc[start:end]
+        index, returns, lag_matrix = self.get_lag_features(symbol, start,
+                                                           end, lags)
+        self.cols = ['lag_%d' % lag for lag in range(1, lags + 1)]
+        data = pd.DataFrame(lag_matrix, index=index, columns=self.cols)
+        data.insert(0, symbol, self.raw_data[symbol].loc[start:end])
+        data.insert(1, 'Returns', returns)
+        self.data = data
 
     def run_strategy(self, symbol, start, end, model, lags):
         self.symbol = symbol
@@ -54,6 +155,199 @@ class ScikitBacktester(object):
         return self.data[['Returns', 'Strategy']].cumsum(
                                     ).apply(np.exp).iloc[-1]
 
+    def run_walk_forward(self, symbol, start, end, model, lags,
+                         train_size=252, test_size=21, window='expanding',
+                         max_workers=None):
+        """ Out-of-sample backtest: the model is fit on a training window
+        and predicts the following test_size days, fold by fold.
+        The folds are fit in parallel; the feature matrix is built once
+        and shared with the worker processes via shared memory.
+
+        Returns a DataFrame with the per-fold results; the stitched
+        out-of-sample data is stored in self.data (see plot_results).
+        """
+        self.symbol = symbol
+        self.model = model
+        self.prepare_data(symbol, start, end, lags)
+        data = self.data.dropna()
+        array = np.column_stack((data['Returns'].values,
+                                 data[self.cols].values)).astype(float)
+        folds = walk_forward_folds(len(data), train_size, test_size, window)
+        if not folds:
+            raise ValueError('Not enough data for a single fold')
+
+        memory = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        try:
+            np.ndarray(array.shape, dtype=float, buffer=memory.buf)[:] = array
+            with ProcessPoolExecutor(max_workers,
+                                     initializer=_attach_shared_array,
+                                     initargs=(memory.name, array.shape)
+                                     ) as executor:
+                predictions = list(executor.map(
+                    _fit_fold, [(model,) + fold for fold in folds]))
+        finally:
+            memory.close()
+            memory.unlink()
+
+        test_start = folds[0][2]
+        self.data = data.iloc[test_start:][['Returns']].copy()
+        self.data['Prediction'] = np.concatenate(predictions)
+        self.data['Strategy'] = self.data['Prediction'] * self.data['Returns']
+        self.data['Fold'] = np.repeat(np.arange(len(folds)),
+                                      [fold[3] - fold[2] for fold in folds])
+        results = []
+        for i, (train_start, train_end, fold_start, fold_end) in enumerate(folds):
+            fold_data = self.data[self.data['Fold'] == i]
+            results.append({
+                'train_start': data.index[train_start],
+                'train_end': data.index[train_end - 1],
+                'test_start': data.index[fold_start],
+                'test_end': data.index[fold_end - 1],
+                'Returns': np.exp(fold_data['Returns'].sum()),
+                'Strategy': np.exp(fold_data['Strategy'].sum()),
+                'hit_ratio': (np.sign(fold_data['Prediction']) ==
+                              np.sign(fold_data['Returns'])).mean()})
+        self.fold_results = pd.DataFrame(results)
+        return self.fold_results
+
+    def run_grid(self, symbols=None, models=models, lags=range(1, 21),
+                 start=None, end=None, max_workers=None, checkpoint=None):
+        """ Runs the in-sample backtest of run_strategy for all
+        combinations of symbols, models and lags on a process pool.
+
+        The lag features are built once per symbol for the largest lag
+        and shared with the workers via shared memory; smaller lags use
+        the leading columns. Rows without a return are dropped.
+
+        checkpoint: string
+            path of a CSV file to which each result is appended as soon
+            as it is available; combinations already in the file are
+            skipped, so an interrupted grid can be resumed
+
+        Returns a DataFrame with one row per combination.
+        """
+        if symbols is None:
+            symbols = list(self.raw_data.columns)
+        lags = list(lags)
+        max_lags = max(lags)
+        columns = ['symbol', 'model', 'lags', 'Returns', 'Strategy',
+                   'hit_ratio']
+        done = pd.DataFrame(columns=columns)
+        if checkpoint is not None and os.path.exists(checkpoint):
+            done = pd.read_csv(checkpoint)
+        finished = set(zip(done['symbol'], done['model'], done['lags']))
+
+        arrays = []
+        for symbol in symbols:
+            _, returns, lag_matrix = self.get_lag_features(symbol, start,
+                                                           end, max_lags)
+            valid = ~np.isnan(returns)
+            arrays.append(np.column_stack((returns[valid],
+                                           lag_matrix[valid])))
+        shape = (len(arrays), max(len(array) for array in arrays),
+                 max_lags + 1)
+        tasks = [(symbol, i, len(arrays[i]), model, lag)
+                 for i, symbol in enumerate(symbols)
+                 for model in models for lag in lags
+                 if (symbol, model, lag) not in finished]
+
+        results = []
+        memory = shared_memory.SharedMemory(create=True,
+                                            size=int(np.prod(shape)) * 8)
+        try:
+            shared = np.ndarray(shape, dtype=float, buffer=memory.buf)
+            for i, array in enumerate(arrays):
+                shared[i, :len(array)] = array
+            with ProcessPoolExecutor(max_workers,
+                                     initializer=_attach_shared_array,
+                                     initargs=(memory.name, shape)
+                                     ) as executor:
+                if checkpoint is not None and not os.path.exists(checkpoint):
+                    done.to_csv(checkpoint, index=False)
+                for result in executor.map(_run_combination, tasks):
+                    results.append(result)
+                    if checkpoint is not None:
+                        pd.DataFrame([result], columns=columns).to_csv(
+                            checkpoint, mode='a', header=False, index=False)
+        finally:
+            del shared
+            memory.close()
+            memory.unlink()
+
+        results = pd.DataFrame(results, columns=columns)
+        if len(done) > 0:
+            results = pd.concat([done, results], ignore_index=True)
+        self.grid_results = results
+        return self.grid_results
+
+    def run_online(self, symbol, start, end, model, lags, batch_size=1,
+                   warmup=20, refit_every=21):
+        """ Streaming backtest: the model is updated with partial_fit on
+        each mini-batch of batch_size bars after predicting it, so every
+        prediction only uses earlier bars. The first warmup bars are only
+        used for training. Both modes learn up (+1) vs. not up (-1).
+
+        As baseline, the batch model is refit on all earlier bars every
+        refit_every bars. Returns throughput (bars per second), hit
+        ratios and gross performance of both, and the share of equal
+        predictions; the online results are stored in self.data.
+        """
+        self.symbol = symbol
+        self.model = model
+        index, returns, lag_matrix = self.get_lag_features(symbol, start,
+                                                           end, lags)
+        valid = ~np.isnan(returns)
+        index, returns = index[valid], returns[valid]
+        features = lag_matrix[valid].astype(float)
+        # two classes only: with partial_fit, a class first seen late
+        # (zero returns) would have no statistics in GaussianNB
+        labels = np.where(returns > 0, 1., -1.)
+        n = len(returns)
+        if n <= warmup:
+            raise ValueError('Not enough data after the warmup period')
+
+        algorithm = create_online_algorithm(model)
+        if algorithm is None:
+            return 'Model not known.'
+        online = np.zeros(n)
+        t0 = time.perf_counter()
+        if is_classifier(algorithm):
+            algorithm.partial_fit(features[:warmup], labels[:warmup],
+                                  classes=np.array([-1., 1.]))
+        else:
+            algorithm.partial_fit(features[:warmup], labels[:warmup])
+        for i in range(warmup, n, batch_size):
+            online[i:i + batch_size] = algorithm.predict(
+                features[i:i + batch_size])
+            algorithm.partial_fit(features[i:i + batch_size],
+                                  labels[i:i + batch_size])
+        online_time = time.perf_counter() - t0
+
+        batch = np.zeros(n)
+        t0 = time.perf_counter()
+        for train_start, train_end, test_start, test_end in \
+                walk_forward_folds(n, warmup, refit_every):
+            algorithm = create_algorithm(model)
+            algorithm.fit(features[:train_end], labels[:train_end])
+            batch[test_start:test_end] = algorithm.predict(
+                features[test_start:test_end])
+        batch_time = time.perf_counter() - t0
+
+        self.data = pd.DataFrame({'Returns': returns, 'Prediction': online,
+                                  'Batch': batch}, index=index)
+        self.data['Strategy'] = self.data['Prediction'] * self.data['Returns']
+        out = slice(warmup, None)
+        return pd.Series({
+            'bars': n - warmup,
+            'online_bars_per_second': (n - warmup) / online_time,
+            'batch_bars_per_second': (n - warmup) / batch_time,
+            'online_hit_ratio': (np.sign(online[out]) == labels[out]).mean(),
+            'batch_hit_ratio': (np.sign(batch[out]) == labels[out]).mean(),
+            'agreement': (np.sign(online[out]) == np.sign(batch[out])).mean(),
+            'Returns': np.exp(returns[out].sum()),
+            'online_Strategy': np.exp((online * returns)[out].sum()),
+            'batch_Strategy': np.exp((batch * returns)[out].sum())})
+
     def plot_results(self):
         try:
             self.data[['Returns', 'Strategy']].cumsum(
@@ -0,0 +1,211 @@
+#
+# Local Week Cache for the FXCM Tick Data
+#
+# Every parsed week is stored below <cache_dir>/<symbol>/<year>/<week>/
+# as one .npy file for the datetime64[ns] index and one per column;
+# manifest.json in the cache root lists all weeks with their sizes and
+# the time of last access, and the least recently used weeks are
+# evicted once the cache grows beyond max_bytes. Every week directory
+# also holds its own entry (week.json), so that weeks written by other
+# processes or before a crash are found again by scanning the cache.
+#
+import os
+import glob
+import json
+import time
+import shutil
+import threading
+import contextlib
+import numpy as np
+import pandas as pd
+import datetime as dt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CACHE_DIR = os.environ.get('FXCM_TICK_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache',
+                                        'fxcm_tick_data'))
+MAX_BYTES = 2 * 1024 ** 3
+
+
+def is_closed(year, week, now=None):
+    """ Returns True if the ISO week is over; weeks still running are
+    incomplete on the server and not cached. """
+    if now is None:
+        now = dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+    monday = dt.datetime.fromisocalendar(year, week, 1)
+    return monday + dt.timedelta(days=7) <= now
+
+
+class TickCache(object):
+    """ Size-capped on-disk cache of parsed tick data weeks.
+
+    Arguments:
+    ==========
+    cache_dir: string
+        root directory of the cache, defaults to CACHE_DIR
+
+    max_bytes: int
+        maximum size of the cached files; least recently used
+        weeks are removed beyond that
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=MAX_BYTES):
+        if cache_dir is None:
+            cache_dir = CACHE_DIR
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.manifest = self.read_manifest()
+
+    @staticmethod
+    def key(symbol, year, week):
+        return '%s/%d/%d' % (symbol, year, week)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, *key.split('/'))
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        """ Exclusive lock on the cache directory across processes
+        (where fcntl is available) """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, 'manifest.lock'), 'w') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_manifest(self):
+        """ Returns the manifest, including the weeks found on disk
+        but missing from manifest.json """
+        try:
+            with open(os.path.join(self.cache_dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {'weeks': {}}
+        for key, entry in self.scan().items():
+            manifest['weeks'].setdefault(key, entry)
+        return manifest
+
+    def scan(self):
+        """ Returns the entries of all week directories on disk """
+        entries = {}
+        pattern = os.path.join(self.cache_dir, '*', '*', '*', 'week.json')
+        for file_path in glob.glob(pattern):
+            symbol, year, week = os.path.relpath(
+                file_path, self.cache_dir).split(os.sep)[:3]
+            if not (year.isdigit() and week.isdigit()):
+                # weeks still being written
+                continue
+            key = self.key(symbol, int(year), int(week))
+            try:
+                with open(file_path) as f:
+                    entry = json.load(f)
+                entry['last_access'] = os.path.getmtime(file_path)
+            except (OSError, ValueError):
+                continue
+            entries[key] = entry
+        return entries
+
+    def save(self):
+        """ Merges the manifest with manifest.json and the weeks on
+        disk, evicts the least recently used weeks beyond max_bytes
+        and writes the manifest """
+        with self.lock, self.file_lock():
+            weeks = self.read_manifest()['weeks']
+            for key, entry in self.manifest['weeks'].items():
+                if key not in weeks or \
+                        weeks[key]['last_access'] < entry['last_access']:
+                    weeks[key] = entry
+            # weeks evicted elsewhere are gone from disk
+            weeks = {key: entry for key, entry in weeks.items()
+                     if os.path.isdir(self.path(key))}
+            total = sum(entry['bytes'] for entry in weeks.values())
+            for key in sorted(weeks, key=lambda k: weeks[k]['last_access']):
+                if total <= self.max_bytes:
+                    break
+                total -= weeks.pop(key)['bytes']
+                shutil.rmtree(self.path(key), ignore_errors=True)
+            self.manifest = {'weeks': weeks}
+            file_path = os.path.join(self.cache_dir, 'manifest.json')
+            tmp_path = file_path + '.tmp%d' % os.getpid()
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=2)
+            os.replace(tmp_path, file_path)
+
+    def size(self):
+        """ Returns the size of the cached files in bytes """
+        with self.lock:
+            return sum(entry['bytes']
+                       for entry in self.manifest['weeks'].values())
+
+    def load(self, symbol, year, week):
+        """ Returns the cached week as pandas DataFrame with
+        DatetimeIndex or None if the week is not cached """
+        key = self.key(symbol, year, week)
+        with self.lock:
+            entry = self.manifest['weeks'].get(key)
+        if entry is None:
+            return None
+        path = self.path(key)
+        try:
+            arrays = {column: np.load(os.path.join(path, file_name))
+                      for column, file_name in entry['files'].items()}
+        except OSError:
+            with self.lock:
+                self.manifest['weeks'].pop(key, None)
+            return None
+        index = pd.DatetimeIndex(arrays.pop('index'),
+                                 name=entry['index_name'])
+        with self.lock:
+            entry['last_access'] = time.time()
+        return pd.DataFrame(arrays, index=index, columns=entry['columns'])
+
+    def store(self, symbol, year, week, data):
+        """ Stores the parsed week (DataFrame with DatetimeIndex) """
+        key = self.key(symbol, year, week)
+        path = self.path(key)
+        tmp_path = path + '.tmp%d-%d' % (os.getpid(), threading.get_ident())
+        os.makedirs(tmp_path, exist_ok=True)
+        files = {'index': 'index.npy'}
+        arrays = {'index': data.index.values.astype('datetime64[ns]')}
+        for i, column in enumerate(data.columns):
+            files[column] = 'column_%03d.npy' % i
+            arrays[column] = data[column].values
+        size = 0
+        for column, array in arrays.items():
+            file_path = os.path.join(tmp_path, files[column])
+            np.save(file_path, array)
+            size += os.path.getsize(file_path)
+        entry = {'rows': len(data),
+                 'bytes': size,
+                 'index_name': data.index.name,
+                 'columns': list(data.columns),
+                 'files': files}
+        with open(os.path.join(tmp_path, 'week.json'), 'w') as f:
+            json.dump(entry, f)
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # stored by another process in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        entry['last_access'] = time.time()
+        with self.lock:
+            self.manifest['weeks'][key] = entry
+
+    def clear(self):
+        """ Removes all cached weeks """
+        with self.lock, self.file_lock():
+            keys = set(self.manifest['weeks'])
+            keys.update(self.read_manifest()['weeks'])
+            for key in keys:
+                shutil.rmtree(self.path(key), ignore_errors=True)
+            self.manifest['weeks'] = {}
+        self.save()